@@ -0,0 +1 @@
+# Lets pytest import the implementation package from the repository root
@@ -0,0 +1,65 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from implementation import nx_algorithm
+from implementation import static_algorithm
+from implementation.instance_io import is_binary_instance, is_dimacs_instance, load_instance
+from implementation.max_flow import MaxFlow
+
+BACKENDS = ("static", "nx", "auto")
+
+# Backend that "auto" resolves to. The networkx library was faster than the static algorithm on every family and size
+# of the benchmark suite, even on the smallest instances, so there is no size below which the static algorithm wins
+AUTO_BACKEND = "nx"
+
+# Find the instances to solve, either all json, DIMACS and binary instances of a directory or the entries of a
+# manifest file. A manifest is a json list whose entries are either paths or {"path": ..., "backend": ...} objects,
+# relative paths are resolved against the directory of the manifest
+def read_instances(source: str, backend: str = "auto") -> list[tuple[str, str]]:
+    if os.path.isdir(source):
+        paths = [os.path.join(source, name) for name in sorted(os.listdir(source))]
+        return [(path, backend) for path in paths
+                if path.endswith(".json") or is_dimacs_instance(path) or is_binary_instance(path)]
+    with open(source, "r") as file:
+        entries = json.load(file)
+    base = os.path.dirname(source)
+    instances = []
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {"path": entry}
+        instances.append((os.path.join(base, entry["path"]), entry.get("backend", backend)))
+    return instances
+
+# Solve a single min cost flow or max flow instance, in json, DIMACS or binary format, with the given backend.
+# The value is an int for every backend, as the flows are integral
+def solve_instance(path: str, backend: str = "auto") -> dict:
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend!r}, expected one of {BACKENDS}")
+    start = time.perf_counter()
+    I = load_instance(path)
+    is_max_flow = isinstance(I, MaxFlow)
+    if backend == "auto":
+        backend = AUTO_BACKEND
+    algorithm = static_algorithm if backend == "static" else nx_algorithm
+    if is_max_flow:
+        value, flow = algorithm.find_max_flow(I)
+    else:
+        value, flow = algorithm.find_min_cost_flow(I)
+    return {"path": path, "problem": "max_flow" if is_max_flow else "min_cost_flow", "backend": backend,
+            "value": int(value), "flow": [int(x) for x in flow],
+            "seconds": time.perf_counter() - start}
+
+# Solve all the instances of a directory or manifest concurrently on a process pool,
+# yielding the result of every instance as soon as it finishes. Failed instances yield a result with an error
+def solve_batch(source: str, backend: str = "auto", workers: int = None):
+    instances = read_instances(source, backend)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(solve_instance, path, instance_backend): path
+                   for path, instance_backend in instances}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as error:
+                yield {"path": futures[future], "error": repr(error)}
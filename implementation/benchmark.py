@@ -0,0 +1,169 @@
+import argparse
+import contextlib
+import io
+import json
+import time
+import tracemalloc
+
+import numpy as np
+
+from implementation import instrumentation
+from implementation import nx_algorithm
+from implementation import static_algorithm
+from implementation.circulation_cache import circulation_cache
+from implementation.instrumentation import Tracer
+from implementation.intial_point import find_initial_feasible_flow
+from implementation.min_cost_flow import MinCostFlow
+from implementation.min_ratio_cycle_finder import DynamicMinRatioCycleFinder
+from implementation.min_ratio_cycles import find_cached_circulations, find_min_ratio_cycle
+
+# Build a min cost flow instance on the given edges with random costs in [1, C] and capacities in [1, U].
+# The demands are those of a random integral flow within the capacities, so every generated instance is feasible
+def random_instance(rng: np.random.Generator, n: int, tails: np.ndarray, heads: np.ndarray, C: int, U: int):
+    m = len(tails)
+    costs = rng.integers(1, C + 1, m)
+    upper_capacities = rng.integers(1, U + 1, m)
+    flow = rng.integers(0, upper_capacities + 1)
+    demands = (np.bincount(tails, weights=flow, minlength=n).astype(int)
+               - np.bincount(heads, weights=flow, minlength=n).astype(int))
+    edges = list(zip(tails.tolist(), heads.tolist()))
+    return MinCostFlow(nodes=n, demands=demands, edges=edges, costs=costs, lower_capacities=np.zeros(m, dtype=int),
+                       upper_capacities=upper_capacities)
+
+# Grid of rows x cols vertices with edges to the right and downwards neighbours
+def grid_instance(seed: int, rows: int, cols: int, C: int = 10, U: int = 10):
+    rng = np.random.default_rng(seed)
+    vertex = np.arange(rows * cols).reshape(rows, cols)
+    tails = np.concatenate((vertex[:, :-1].ravel(), vertex[:-1, :].ravel()))
+    heads = np.concatenate((vertex[:, 1:].ravel(), vertex[1:, :].ravel()))
+    return random_instance(rng, rows * cols, tails, heads, C, U)
+
+# Layered graph with the given number of layers and vertices per layer, every vertex has edges to
+# `degree` random vertices of the next layer
+def layered_instance(seed: int, layers: int, width: int, degree: int = 2, C: int = 10, U: int = 10):
+    rng = np.random.default_rng(seed)
+    tails = np.repeat(np.arange((layers - 1) * width), degree)
+    heads = (tails // width + 1) * width + rng.integers(0, width, len(tails))
+    keep = np.unique(tails * layers * width + heads, return_index=True)[1]
+    return random_instance(rng, layers * width, tails[np.sort(keep)], heads[np.sort(keep)], C, U)
+
+# Bipartite transportation problem from `suppliers` to `consumers`, with every supplier connected to
+# `degree` random consumers
+def transportation_instance(seed: int, suppliers: int, consumers: int, degree: int = 3, C: int = 10, U: int = 10):
+    rng = np.random.default_rng(seed)
+    tails = np.repeat(np.arange(suppliers), degree)
+    heads = suppliers + np.array([rng.choice(consumers, degree, replace=False) for _ in range(suppliers)]).ravel()
+    return random_instance(rng, suppliers + consumers, tails, heads, C, U)
+
+# Dense random graph with m edges on n vertices, which is allowed to contain parallel edges
+def dense_instance(seed: int, n: int, m: int, C: int = 10, U: int = 10):
+    rng = np.random.default_rng(seed)
+    tails = rng.integers(0, n, m)
+    heads = (tails + rng.integers(1, n, m)) % n # No self loops
+    return random_instance(rng, n, tails, heads, C, U)
+
+GENERATORS = {
+    "grid": lambda seed, size, C, U: grid_instance(seed, size, size, C, U),
+    "layered": lambda seed, size, C, U: layered_instance(seed, size, size, 2, C, U),
+    "transportation": lambda seed, size, C, U: transportation_instance(seed, size, size, min(3, size), C, U),
+    "dense": lambda seed, size, C, U: dense_instance(seed, size, 3 * size, C, U),
+}
+
+# Time a function call with all printing suppressed
+def time_call(function, *args, **kwargs):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+# Peak traced memory of a function call with all printing suppressed. Tracing every allocation slows the call down
+# several times, so it is measured in a run of its own
+def measure_peak_memory(function, *args, **kwargs) -> int:
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            function(*args, **kwargs)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+# Time a function call, and measure its peak traced memory in a second untimed run, see measure_peak_memory
+def measure(function, *args, **kwargs):
+    result, seconds = time_call(function, *args, **kwargs)
+    return result, seconds, measure_peak_memory(function, *args, **kwargs)
+
+# Benchmark every phase of the static algorithm on one generated instance and compare against networkx.
+# The full static solver only runs when the instance has at most max_static_edges edges, or always if that is None
+def benchmark_instance(family: str, seed: int, size: int, C: int, U: int, cycle_strategy: str = "spanning_tree",
+                       ipm_steps: int = 20, max_static_edges: int = None) -> dict:
+    I, build_seconds = time_call(GENERATORS[family], seed, size, C, U)
+    report = {"family": family, "seed": seed, "size": size, "n": I.n, "m": I.m, "C": C, "U": U,
+              "cycle_strategy": cycle_strategy, "construction_seconds": build_seconds}
+    (I_feasible, flow), report["initial_point_seconds"] = time_call(find_initial_feasible_flow, I)
+    circulations, report["cycle_enumeration_seconds"], report["cycle_enumeration_peak_bytes"] = \
+        measure(find_cached_circulations, I_feasible, cycle_strategy, None)
+    report["circulations"] = circulations.shape[0]
+    I_feasible.min_ratio_cycle_finder = DynamicMinRatioCycleFinder(circulations)
+    (nx_cost, _), report["nx_seconds"], report["nx_peak_bytes"] = measure(nx_algorithm.find_min_cost_flow, I.copy())
+    report["nx_cost"] = int(nx_cost)
+    # Time single interior point steps at the optimal cost, starting from the initial point
+    steps = 0
+    start = time.perf_counter()
+    with np.errstate(all="ignore"):
+        for _ in range(ipm_steps):
+            _, step = find_min_ratio_cycle(I_feasible, flow, nx_cost, cycle_strategy)
+            if not np.any(step):
+                break
+            flow = flow + step
+            steps += 1
+    report["ipm_step_seconds"] = (time.perf_counter() - start) / max(steps, 1)
+    if max_static_edges is None or I.m <= max_static_edges:
+        # Both runs of the static solver enumerate the circulations themselves, only the first one is traced
+        circulation_cache.clear()
+        with instrumentation.tracing(Tracer(keep_events=False)) as tracer, np.errstate(all="ignore"):
+            (static_cost, _), report["static_seconds"] = time_call(static_algorithm.find_min_cost_flow, I,
+                                                                   cycle_strategy)
+        circulation_cache.clear()
+        with np.errstate(all="ignore"):
+            report["static_peak_bytes"] = measure_peak_memory(static_algorithm.find_min_cost_flow, I, cycle_strategy)
+        report["static_cost"] = static_cost.item()
+        report["probes"] = tracer.counters["probes"]
+        report["iterations"] = tracer.counters["iterations"]
+        report["cycles_scored"] = tracer.counters["cycles_scored"]
+        report["seconds_per_probe"] = report["static_seconds"] / max(tracer.counters["probes"], 1)
+        report["speedup_vs_nx"] = report["nx_seconds"] / report["static_seconds"]
+        report["costs_match"] = bool(static_cost == nx_cost)
+    return report
+
+# Run the benchmark for every family, size and (C, U) pair, yielding one report per instance
+def run_benchmarks(families: list[str], sizes: list[int], seeds: list[int], scales: list[tuple[int, int]],
+                   cycle_strategy: str = "spanning_tree", max_static_edges: int = 200):
+    for family in families:
+        for size in sizes:
+            for C, U in scales:
+                for seed in seeds:
+                    yield benchmark_instance(family, seed, size, C, U, cycle_strategy,
+                                             max_static_edges=max_static_edges)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the static algorithm against networkx")
+    parser.add_argument("--families", nargs="+", default=list(GENERATORS), choices=list(GENERATORS))
+    parser.add_argument("--sizes", nargs="+", type=int, default=[3, 4])
+    parser.add_argument("--seeds", nargs="+", type=int, default=[0])
+    parser.add_argument("--scales", nargs="+", default=["10,10"], help="C,U pairs of maximum cost and capacity")
+    parser.add_argument("--cycle-strategy", default="spanning_tree")
+    parser.add_argument("--max-static-edges", type=int, default=200,
+                        help="only run the full static solver on instances with at most this many edges")
+    parser.add_argument("--output", help="append the reports to this file as json lines")
+    args = parser.parse_args()
+    scales = [tuple(int(x) for x in scale.split(",")) for scale in args.scales]
+    output = open(args.output, "a") if args.output else None
+    for report in run_benchmarks(args.families, args.sizes, args.seeds, scales, args.cycle_strategy,
+                                 args.max_static_edges):
+        print(json.dumps(report))
+        if output is not None:
+            output.write(json.dumps(report) + "\n")
+            output.flush()
+    if output is not None:
+        output.close()
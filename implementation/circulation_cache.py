@@ -0,0 +1,109 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from collections import OrderedDict
+
+import numpy as np
+import scipy.sparse as sp
+
+from implementation import instrumentation
+from implementation.min_cost_flow import MinCostFlow
+
+# Cache of the candidate circulations of a graph, keyed by a hash of its topology and the cycle strategy.
+# Entries are kept in memory with LRU eviction, and optionally persisted on disk as one directory per key holding
+# the CSR arrays as .npy files, which are memory-mapped back when loaded so that processes share their pages
+class CirculationCache:
+    def __init__(self, max_entries: int = 16, directory: str = None):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    # Hash of the edge list of the instance, costs, capacities and demands do not change the circulations
+    @staticmethod
+    def topology_key(I: MinCostFlow, strategy: str) -> str:
+        digest = hashlib.sha1()
+        digest.update(f"{strategy}:{I.n}:{I.m}:".encode())
+        digest.update(np.ascontiguousarray(I.tails, dtype=np.int32).tobytes())
+        digest.update(np.ascontiguousarray(I.heads, dtype=np.int32).tobytes())
+        return digest.hexdigest()
+
+    # Get the circulations of the instance, computing them with find_circulations(I, strategy) only on a miss
+    def get_or_compute(self, I: MinCostFlow, strategy: str, find_circulations) -> sp.csr_matrix:
+        key = self.topology_key(I, strategy)
+        circulations = self.get(key)
+        tracer = instrumentation.tracer
+        if circulations is None:
+            self.misses += 1
+            start = time.perf_counter()
+            circulations = sp.csr_matrix(find_circulations(I, strategy))
+            self.put(key, circulations)
+            if tracer is not None:
+                tracer.count("cycle_enumerations")
+                tracer.emit("cycle_enumeration", strategy=strategy, circulations=circulations.shape[0],
+                            seconds=time.perf_counter() - start)
+        else:
+            self.hits += 1
+            if tracer is not None:
+                tracer.count("circulation_cache_hits")
+        return circulations
+
+    def get(self, key: str):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        circulations = self.load(key)
+        if circulations is not None:
+            self.remember(key, circulations)
+        return circulations
+
+    def put(self, key: str, circulations: sp.csr_matrix):
+        self.remember(key, circulations)
+        self.save(key, circulations)
+
+    # Store the entry in memory, evicting the least recently used entries above the limit
+    def remember(self, key: str, circulations: sp.csr_matrix):
+        self.entries[key] = circulations
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+    # Write the CSR arrays of an entry to disk, going through a temporary directory so readers never see partial files
+    def save(self, key: str, circulations: sp.csr_matrix):
+        if self.directory is None:
+            return
+        path = os.path.join(self.directory, key)
+        if os.path.isdir(path):
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = tempfile.mkdtemp(dir=self.directory, prefix=f".{key}-")
+        np.save(os.path.join(temp_path, "data.npy"), circulations.data)
+        np.save(os.path.join(temp_path, "indices.npy"), circulations.indices)
+        np.save(os.path.join(temp_path, "indptr.npy"), circulations.indptr)
+        np.save(os.path.join(temp_path, "shape.npy"), np.array(circulations.shape, dtype=np.int64))
+        try:
+            os.rename(temp_path, path)
+        except OSError: # Another process stored the same entry first
+            shutil.rmtree(temp_path, ignore_errors=True)
+
+    # Memory-map the CSR arrays of an entry from disk, if present
+    def load(self, key: str):
+        if self.directory is None:
+            return None
+        path = os.path.join(self.directory, key)
+        if not os.path.isdir(path):
+            return None
+        data = np.load(os.path.join(path, "data.npy"), mmap_mode="r")
+        indices = np.load(os.path.join(path, "indices.npy"), mmap_mode="r")
+        indptr = np.load(os.path.join(path, "indptr.npy"), mmap_mode="r")
+        shape = tuple(np.load(os.path.join(path, "shape.npy")))
+        return sp.csr_matrix((data, indices, indptr), shape=shape, copy=False)
+
+# Cache shared by all solves in the process, set its directory to also persist circulations on disk
+circulation_cache = CirculationCache()
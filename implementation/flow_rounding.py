@@ -0,0 +1,181 @@
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import maximum_flow
+
+from implementation import instrumentation
+from implementation.min_cost_flow import MinCostFlow
+
+# Turn a fractional flow, such as the one found by the interior point method, into an optimal integral flow.
+# The flow is rounded into a feasible flow, see round_to_feasible_flow, and negative cost cycles of the residual graph
+# are cancelled until there are none left, which proves optimality.
+# Returns None if the demands cannot be met, which means the instance is infeasible
+def round_to_optimal_flow(I: MinCostFlow, flow: np.ndarray):
+    flow = round_to_feasible_flow(I, flow)
+    if flow is None:
+        return None
+    cancelled_cycles = cancel_negative_cycles(I, flow)
+    tracer = instrumentation.tracer
+    if tracer is not None:
+        tracer.count("cancelled_cycles", cancelled_cycles)
+    return flow
+
+# Turn a fractional flow into a feasible integral flow. The flow is rounded into the capacities and conservation is
+# repaired with a maximum flow in the residual graph. Returns None if the demands cannot be met
+def round_to_feasible_flow(I: MinCostFlow, flow: np.ndarray):
+    flow = np.clip(np.round(flow), I.lower_capacities, I.upper_capacities).astype(np.int64)
+    repaired_units = repair_flow(I, flow)
+    if repaired_units is None:
+        return None
+    tracer = instrumentation.tracer
+    if tracer is not None:
+        tracer.count("repaired_units", repaired_units)
+    return flow
+
+# Residual graph of the flow, arc e < m is the forward arc of edge e and arc m + e its backward arc.
+# Returns the tails, heads, costs and residual capacities of all arcs with a positive residual capacity,
+# together with their arc indices
+def residual_graph(I: MinCostFlow, flow: np.ndarray):
+    tails = np.concatenate((I.tails, I.heads))
+    heads = np.concatenate((I.heads, I.tails))
+    costs = np.concatenate((I.costs, -I.costs)).astype(np.int64)
+    capacities = np.concatenate((I.upper_capacities - flow, flow - I.lower_capacities))
+    arcs = np.flatnonzero(capacities > 0)
+    return tails[arcs], heads[arcs], costs[arcs], capacities[arcs], arcs
+
+# Push delta units of flow along the given arcs of the residual graph, delta is either a single amount or one per arc
+def augment(I: MinCostFlow, flow: np.ndarray, arcs: np.ndarray, delta):
+    deltas = np.broadcast_to(delta, arcs.shape)
+    forward = arcs < I.m
+    np.add.at(flow, arcs[forward], deltas[forward])
+    np.subtract.at(flow, arcs[~forward] - I.m, deltas[~forward])
+
+# Make the flow satisfy the demands by rerouting flow through the residual graph from nodes that send too little to
+# nodes that send too much, staying within the capacities, see reroute_excess. Every round pushes at least
+# MAX_FLOW_CAPACITY units unless it meets all demands, and a round that pushes nothing proves that the demands cannot be
+# met. Returns the number of units of flow that were rerouted, or None if the demands cannot be met
+def repair_flow(I: MinCostFlow, flow: np.ndarray):
+    rerouted = 0
+    while True:
+        excess = (I.demands - I.find_demand_residuals(flow)).astype(np.int64) # Positive where a node has to send more
+        if not np.any(excess):
+            return rerouted
+        units = reroute_excess(I, flow, excess)
+        if units == 0:
+            return None
+        rerouted += units
+
+# Largest arc capacity that scipy's maximum_flow accepts
+MAX_FLOW_CAPACITY = np.iinfo(np.int32).max
+
+# Push a maximum flow from a super source to a super sink through the residual graph, found with Dinic's algorithm,
+# where the source feeds the nodes with positive excess and the sink drains those with negative excess. The capacities
+# are capped at MAX_FLOW_CAPACITY, so the flow is only maximal among flows within the capped capacities. The flow is
+# split over the parallel arcs between every pair of nodes. Returns the number of units that were pushed
+def reroute_excess(I: MinCostFlow, flow: np.ndarray, excess: np.ndarray) -> int:
+    tails, heads, _, capacities, arcs = residual_graph(I, flow)
+    loops = tails == heads # Self loops cannot carry any rerouted flow
+    tails, heads, capacities, arcs = tails[~loops], heads[~loops], capacities[~loops], arcs[~loops]
+    source, sink = I.n, I.n + 1
+    senders = np.flatnonzero(excess > 0)
+    receivers = np.flatnonzero(excess < 0)
+    network = sp.csr_matrix((np.concatenate((capacities, excess[senders], -excess[receivers])),
+                             (np.concatenate((tails, np.full(len(senders), source), receivers)),
+                              np.concatenate((heads, senders, np.full(len(receivers), sink))))),
+                            shape=(I.n + 2, I.n + 2), dtype=np.int64) # Parallel arcs are summed up
+    network.data = np.minimum(network.data, MAX_FLOW_CAPACITY).astype(np.int32)
+    result = maximum_flow(network, source, sink, method="dinic")
+    # Split the flow from u to v over the arcs from u to v, filling them in order
+    pair_flow = result.flow.tocsr()[tails, heads].A1.astype(np.int64)
+    order = np.lexsort((heads, tails))
+    sorted_capacities = capacities[order]
+    filled_before = np.cumsum(sorted_capacities) - sorted_capacities
+    group_starts = np.r_[True, (tails[order][1:] != tails[order][:-1]) | (heads[order][1:] != heads[order][:-1])]
+    filled_before -= np.maximum.accumulate(np.where(group_starts, filled_before, 0))
+    deltas = np.zeros(len(arcs), dtype=np.int64)
+    deltas[order] = np.clip(pair_flow[order] - filled_before, 0, sorted_capacities)
+    used = deltas > 0
+    augment(I, flow, arcs[used], deltas[used])
+    return int(result.flow_value)
+
+# Cancel negative cost cycles of the residual graph until there are none left, pushing as much flow as possible
+# around every cycle. Cycles are searched with capacity scaling: while delta > 1 only arcs with a residual capacity of
+# at least delta are considered, so the first cycles cancelled each move a lot of flow, and delta is halved whenever
+# no such cycle is left. Every Bellman-Ford pass cancels all the disjoint cycles it finds and the next pass starts from
+# its distances. Returns the number of cancelled cycles
+def cancel_negative_cycles(I: MinCostFlow, flow: np.ndarray) -> int:
+    cycles = 0
+    width = int(np.max(I.upper_capacities - I.lower_capacities, initial=0))
+    delta = 1 << max(width.bit_length() - 1, 0)
+    distances = np.zeros(I.n, dtype=np.int64) # Start from a virtual source connected to every node
+    while True:
+        tails, heads, costs, capacities, arcs = residual_graph(I, flow)
+        wide = capacities >= delta
+        tails, heads, costs, capacities, arcs = tails[wide], heads[wide], costs[wide], capacities[wide], arcs[wide]
+        found = find_negative_cycles(I.n, tails, heads, costs, distances)
+        if not found:
+            if delta == 1:
+                return cycles
+            delta //= 2
+            continue
+        for cycle in found: # The cycles are node disjoint, so their residual capacities do not interfere
+            augment(I, flow, arcs[cycle], np.min(capacities[cycle]))
+        cycles += len(found)
+
+# Relax all arcs at once with Bellman-Ford, starting from the given distances, until no distance improves.
+# Arcs are grouped by head so that every round takes the best incoming arc of every node in a few vectorized passes.
+# The predecessor arcs are checked for cycles whenever the number of rounds reaches a power of two, and the cycles are
+# returned as soon as there are any; all such cycles have a negative cost.
+# Returns the distances, the predecessor arc of every node and the cycles of predecessor arcs, empty if there are none
+def relax_arcs(n: int, tails: np.ndarray, heads: np.ndarray, costs: np.ndarray, distances: np.ndarray):
+    order = np.argsort(heads, kind="stable")
+    sorted_heads = heads[order]
+    starts = np.flatnonzero(np.r_[True, sorted_heads[1:] != sorted_heads[:-1]]) if len(order) > 0 else np.zeros(0, int)
+    group_heads = sorted_heads[starts]
+    group_of_arc = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, len(order)]))
+    predecessors = np.full(n, -1)
+    for rounds in range(1, n + 1):
+        candidates = distances[tails[order]] + costs[order]
+        best = np.minimum.reduceat(candidates, starts) if len(starts) > 0 else candidates
+        improved = best < distances[group_heads]
+        if not np.any(improved):
+            return distances, predecessors, []
+        # First arc of every improved group that attains the best candidate distance
+        is_best = (candidates == best[group_of_arc]) & improved[group_of_arc]
+        positions = np.flatnonzero(is_best)
+        groups = group_of_arc[positions]
+        first = np.r_[True, groups[1:] != groups[:-1]]
+        distances[group_heads[groups[first]]] = best[groups[first]]
+        predecessors[group_heads[groups[first]]] = order[positions[first]]
+        if rounds & (rounds - 1) == 0 or rounds == n:
+            cycles = find_predecessor_cycles(predecessors, tails)
+            if cycles:
+                return distances, predecessors, cycles
+    return distances, predecessors, find_predecessor_cycles(predecessors, tails)
+
+# Find all cycles in the graph of predecessor arcs, every cycle returned as its arcs in path order. Every node has a
+# single predecessor, so the cycles are node disjoint
+def find_predecessor_cycles(predecessors: np.ndarray, tails: np.ndarray) -> list[np.ndarray]:
+    parents = np.where(predecessors >= 0, tails[np.maximum(predecessors, 0)], -1).tolist()
+    visited_from = [-1] * len(parents)
+    cycles = []
+    for start in range(len(parents)):
+        node = start
+        while node >= 0 and visited_from[node] == -1:
+            visited_from[node] = start
+            node = parents[node]
+        if node >= 0 and visited_from[node] == start: # The walk from start came back to one of its own nodes
+            cycle = []
+            current = node
+            while True:
+                cycle.append(predecessors[current])
+                current = parents[current]
+                if current == node:
+                    break
+            cycles.append(np.array(cycle[::-1]))
+    return cycles
+
+# Find node disjoint negative cost cycles of the graph, as arrays of arc indices, or an empty list if there is no such
+# cycle. The search relaxes from the given distances, which are updated in place, any finite distances are valid
+def find_negative_cycles(n: int, tails: np.ndarray, heads: np.ndarray, costs: np.ndarray, distances: np.ndarray):
+    _, _, cycles = relax_arcs(n, tails, heads, costs, distances)
+    return cycles
@@ -0,0 +1,129 @@
+import json
+import os
+
+import numpy as np
+
+from implementation.max_flow import MaxFlow
+from implementation.min_cost_flow import MinCostFlow
+
+# Check whether the path is an instance in the columnar binary format
+def is_binary_instance(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, "header.json"))
+
+# Check whether the path is an instance in the DIMACS format
+def is_dimacs_instance(path: str) -> bool:
+    return path.endswith((".min", ".max"))
+
+# Load a min cost flow or max flow instance from a json file, a DIMACS file
+# or a directory in the columnar binary format
+def load_instance(path: str, mmap: bool = True):
+    if is_dimacs_instance(path):
+        return read_dimacs(path)
+    if is_binary_instance(path):
+        with open(os.path.join(path, "header.json"), "r") as file:
+            is_max_flow = json.load(file)["format"] == "max_flow"
+        return MaxFlow.from_binary(path, mmap) if is_max_flow else MinCostFlow.from_binary(path, mmap)
+    with open(path, "r") as file:
+        is_max_flow = "source" in json.load(file)
+    return MaxFlow.from_json(path) if is_max_flow else MinCostFlow.from_json(path)
+
+# Convert a json instance to the columnar binary format
+def convert_to_binary(json_path: str, binary_path: str):
+    load_instance(json_path).to_binary(binary_path)
+
+# Read a DIMACS min cost flow (p min) or max flow (p max) file in chunks of about chunk_size bytes.
+# The arc columns are parsed a chunk at a time straight into arrays preallocated from the problem line,
+# so memory stays bounded by the arrays themselves. Leading whitespace of a line is ignored.
+# DIMACS vertices are numbered from 1, the instance from 0
+def read_dimacs(path: str, chunk_size: int = 1 << 22):
+    problem = None
+    filled = 0
+    with open(path, "r") as file:
+        while True:
+            lines = file.readlines(chunk_size)
+            if not lines:
+                break
+            arc_lines = []
+            for line in lines:
+                line = line.lstrip()
+                kind = line[:1]
+                if kind == "a":
+                    arc_lines.append(line[1:])
+                elif kind == "n":
+                    if problem is None:
+                        raise ValueError(f"Node descriptor before the problem line in {path}")
+                    fields = line.split()
+                    vertex = int(fields[1]) - 1
+                    if problem == "min":
+                        demands[vertex] = int(fields[2])
+                    elif fields[2] == "s":
+                        source = vertex
+                    elif fields[2] == "t":
+                        sink = vertex
+                elif kind == "p":
+                    _, problem, nodes, arcs = line.split()
+                    if problem not in ("min", "max"):
+                        raise ValueError(f"Unsupported DIMACS problem {problem!r} in {path}")
+                    nodes, arcs = int(nodes), int(arcs)
+                    columns = np.zeros((arcs, 5 if problem == "min" else 3), dtype=np.int64)
+                    demands = np.zeros(nodes, dtype=np.int64)
+                    source = sink = None
+            if arc_lines:
+                if problem is None:
+                    raise ValueError(f"Arc descriptor before the problem line in {path}")
+                values = np.array(" ".join(arc_lines).split(), dtype=np.int64)
+                if len(values) != len(arc_lines) * columns.shape[1]:
+                    raise ValueError(f"Expected {columns.shape[1]} fields on every arc line in {path}")
+                values = values.reshape(len(arc_lines), columns.shape[1])
+                if filled + len(values) > len(columns):
+                    raise ValueError(f"Expected {len(columns)} arcs in {path}, found more")
+                columns[filled:filled + len(values)] = values
+                filled += len(values)
+    if problem is None:
+        raise ValueError(f"Missing problem line in {path}")
+    if filled != len(columns):
+        raise ValueError(f"Expected {len(columns)} arcs in {path}, found {filled}")
+    tails = (columns[:, 0] - 1).astype(np.int32)
+    heads = (columns[:, 1] - 1).astype(np.int32)
+    if problem == "max":
+        if source is None or sink is None:
+            raise ValueError(f"Missing source or sink in {path}")
+        I = MaxFlow.__new__(MaxFlow)
+        I.init_from_arrays(tails, heads, columns[:, 2].copy(), source, sink)
+        return I
+    return MinCostFlow.from_arrays(nodes, demands, tails, heads, columns[:, 4].copy(), columns[:, 2].copy(),
+                                   columns[:, 3].copy())
+
+# Write a min cost flow or max flow instance as a DIMACS file, in chunks of chunk_rows arcs.
+# Raises a ValueError for a max flow instance with nonzero lower capacities, which the p max format cannot hold
+def write_dimacs(I, path: str, chunk_rows: int = 1 << 16):
+    if isinstance(I, MaxFlow) and I.lower_capacities is not None and np.any(I.lower_capacities != 0):
+        raise ValueError("DIMACS max flow files cannot hold lower capacities, write the instance as a min cost flow")
+    with open(path, "w") as file:
+        if isinstance(I, MaxFlow):
+            nodes = int(max(np.max(I.tails), np.max(I.heads), I.source, I.sink)) + 1
+            file.write(f"p max {nodes} {len(I.tails)}\n")
+            file.write(f"n {I.source + 1} s\nn {I.sink + 1} t\n")
+            columns = [I.tails + 1, I.heads + 1, I.upper_capacities]
+            row_format = "a %d %d %d"
+        else:
+            file.write(f"p min {I.n} {I.m}\n")
+            supplies = np.nonzero(I.demands)[0]
+            np.savetxt(file, np.column_stack((supplies + 1, I.demands[supplies])), fmt="n %d %d")
+            columns = [I.tails + 1, I.heads + 1, I.lower_capacities, I.upper_capacities, I.costs]
+            row_format = "a %d %d %d %d %d"
+        write_rows(file, columns, row_format, chunk_rows)
+
+# Write a solution of the instance as a DIMACS solution file, the value line followed by one flow line per arc
+def write_dimacs_solution(I, path: str, value, flow: np.ndarray, chunk_rows: int = 1 << 16):
+    with open(path, "w") as file:
+        file.write(f"s {int(round(float(value)))}\n")
+        flow = np.round(np.asarray(flow)).astype(np.int64)
+        write_rows(file, [I.tails + 1, I.heads + 1, flow], "f %d %d %d", chunk_rows)
+
+# Write the given columns row by row with the given format, chunk_rows rows at a time
+def write_rows(file, columns: list[np.ndarray], row_format: str, chunk_rows: int):
+    rows = len(columns[0])
+    for start in range(0, rows, chunk_rows):
+        chunk = np.column_stack([np.asarray(column[start:start + chunk_rows], dtype=np.int64) for column in columns])
+        np.savetxt(file, chunk, fmt=row_format)
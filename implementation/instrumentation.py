@@ -0,0 +1,75 @@
+import contextlib
+import json
+import math
+import time
+from collections import Counter
+
+# Opt-in instrumentation of the solvers. The solvers report to the module level tracer,
+# which is None by default so that an inactive tracer costs a single attribute check per call site
+tracer = None
+
+# Collects solver events, such as the per iteration potential, gap, ratio, step size and timings,
+# together with counters of probes and scored cycles. Every event is passed to the callback and/or written to the
+# file as a json line when given, and is also kept in memory unless keep_events is False
+class Tracer:
+    def __init__(self, callback=None, file=None, keep_events: bool = True, display_instances: bool = False):
+        self.callback = callback
+        self.file = file
+        self.keep_events = keep_events
+        self.display_instances = display_instances
+        self.events = []
+        self.counters = Counter()
+        self.start = time.perf_counter()
+
+    def emit(self, event: str, **fields):
+        record = {"event": event, "time": time.perf_counter() - self.start}
+        for key, value in fields.items():
+            value = value.item() if hasattr(value, "item") else value # Convert numpy scalars
+            if isinstance(value, float) and not math.isfinite(value): # Keep the json lines strictly valid
+                value = None
+            record[key] = value
+        self.record(record)
+
+    # Keep, pass on and write out a finished event record
+    def record(self, record: dict):
+        if self.keep_events:
+            self.events.append(record)
+        if self.callback is not None:
+            self.callback(record)
+        if self.file is not None:
+            self.file.write(json.dumps(record) + "\n")
+
+    def count(self, name: str, amount: int = 1):
+        self.counters[name] += amount
+
+    # Take over the events and counters traced by another tracer, such as the one of a worker process,
+    # whose event times are shifted by the given offset onto the clock of this tracer
+    def merge(self, events: list[dict], counters: Counter, offset: float):
+        for record in events:
+            self.record({**record, "time": record["time"] + offset})
+        self.counters.update(counters)
+
+    # Report an instance, also printing it in full if the tracer was asked to display instances
+    def instance(self, label: str, I):
+        self.emit("instance", label=label, n=I.n, m=I.m)
+        if self.display_instances:
+            print(f"{label}: ")
+            I.display_instance()
+
+    # Write all kept events followed by the counters to the given path as json lines
+    def export_json_lines(self, path: str):
+        with open(path, "w") as file:
+            for record in self.events:
+                file.write(json.dumps(record) + "\n")
+            file.write(json.dumps({"event": "counters", **self.counters}) + "\n")
+
+# Activate the tracer for the duration of the context, restoring the previous tracer afterwards
+@contextlib.contextmanager
+def tracing(active_tracer: Tracer = None):
+    global tracer
+    previous = tracer
+    tracer = active_tracer if active_tracer is not None else Tracer()
+    try:
+        yield tracer
+    finally:
+        tracer = previous
@@ -1,3 +1,6 @@
+import json
+
+from implementation import batch
 from implementation import nx_algorithm
 from implementation import static_algorithm
 from implementation.max_flow import MaxFlow
@@ -35,6 +38,15 @@ def max_flow_static(path: str):
     print(f"Max flow value: {max_flow_value}, Max flow: {max_flow}")
     return max_flow_value, max_flow
 
+# Solve all the instances of a directory or manifest concurrently, printing every result as soon as it finishes
+def solve_batch(source: str, backend: str = "auto", workers: int = None):
+    print(f"Running batch {source}")
+    results = []
+    for result in batch.solve_batch(source, backend, workers):
+        print(json.dumps(result))
+        results.append(result)
+    return results
+
 # Verify that the min cost flow solutions obtained by the static algorithm and nx library are identical
 def min_cost_flow_test(path: str):
     print(f"Testing example {path}")
@@ -1,31 +1,67 @@
 import json
 
-from implementation.min_cost_flow import MinCostFlow
+import numpy as np
+
+from implementation.min_cost_flow import MinCostFlow, read_binary, write_binary
 
 # Data class that contains the specifications to a max flow problem instance
 class MaxFlow:
     def __init__(self, edges: list[tuple[int, int]], upper_capacities: list[int], source: int, sink: int,
                  lower_capacities: list[int] = None):
-        self.edges = edges
+        self.init_from_arrays(np.array([edge[0] for edge in edges], dtype=np.int32),
+                              np.array([edge[1] for edge in edges], dtype=np.int32),
+                              np.array(upper_capacities, dtype=int), source, sink,
+                              None if lower_capacities is None else np.array(lower_capacities, dtype=int), edges)
+
+    # Set up the instance from edge indexed arrays, the arrays are used as they are without being copied
+    def init_from_arrays(self, tails: np.ndarray, heads: np.ndarray, upper_capacities: np.ndarray, source: int,
+                         sink: int, lower_capacities: np.ndarray = None, edges: list[tuple[int, int]] = None):
+        self.tails = tails
+        self.heads = heads
+        self._edges = edges # Built from tails and heads on first access when not given
         self.lower_capacities = lower_capacities
         self.upper_capacities = upper_capacities
         self.source = source
         self.sink = sink
 
+    # List of the (tail, head) tuples of all edges, built on first access
+    @property
+    def edges(self) -> list[tuple[int, int]]:
+        if self._edges is None:
+            self._edges = list(zip(self.tails.tolist(), self.heads.tolist()))
+        return self._edges
+
     # Convert the max flow problem instance to its corresponding min cost flow problem instance
     def to_min_cost_flow(self):
-        edges = self.edges + [(self.sink, self.source)] # Additional edge from sink to source
-        num_nodes = max(max(edge[0], edge[1]) for edge in edges) + 1
-        demands = [0] * num_nodes
-        costs = [0] * len(edges)
+        tails = np.append(self.tails, np.int32(self.sink)) # Additional edge from sink to source
+        heads = np.append(self.heads, np.int32(self.source))
+        num_nodes = int(max(np.max(tails), np.max(heads))) + 1
+        demands = np.zeros(num_nodes, dtype=int)
+        costs = np.zeros(len(tails), dtype=int)
         costs[-1] = -1 # All edges have zero cost except the new edge which has -1 cost
         if self.lower_capacities is None:
-            lower_capacities = [0] * len(edges)
+            lower_capacities = np.zeros(len(tails), dtype=int)
         else:
-            lower_capacities = self.lower_capacities + [0]
-        upper_capacities = self.upper_capacities + [sum(self.upper_capacities)] # The new edge has a capacity equal to the sum of all other upper capacities
-        I = MinCostFlow(nodes=num_nodes, demands=demands, edges=edges, costs=costs, lower_capacities=lower_capacities,
-                        upper_capacities=upper_capacities)
+            lower_capacities = np.append(self.lower_capacities, 0)
+        upper_capacities = np.append(self.upper_capacities, np.sum(self.upper_capacities)) # The new edge has a capacity equal to the sum of all other upper capacities
+        I = MinCostFlow.from_arrays(nodes=num_nodes, demands=demands, tails=tails, heads=heads, costs=costs,
+                                    lower_capacities=lower_capacities, upper_capacities=upper_capacities)
+        return I
+
+    # Write the instance in the columnar binary format, see MinCostFlow.to_binary
+    def to_binary(self, path: str):
+        columns = {"tails": self.tails, "heads": self.heads, "upper_capacities": self.upper_capacities}
+        if self.lower_capacities is not None:
+            columns["lower_capacities"] = self.lower_capacities
+        write_binary(path, {"format": "max_flow", "m": len(self.tails), "source": int(self.source),
+                            "sink": int(self.sink)}, columns)
+
+    # Construct a max flow instance from the columnar binary format, memory-mapping the columns unless mmap is False
+    @staticmethod
+    def from_binary(path: str, mmap: bool = True):
+        header, columns = read_binary(path, "max_flow", mmap)
+        I = MaxFlow.__new__(MaxFlow)
+        I.init_from_arrays(source=header["source"], sink=header["sink"], **columns)
         return I
 
     # Construct a max flow instance from a given json file
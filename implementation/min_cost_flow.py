@@ -1,30 +1,60 @@
+import copy
 import json
+import os
 
 import numpy as np
+import scipy.sparse as sp
 
 # Data class that contains the specifications to a min cost flow problem instance
 class MinCostFlow:
     def __init__(self, nodes: int, demands: list[int], edges: list[tuple[int, int]], costs: list[int],
                  lower_capacities: list[int], upper_capacities: list[int]):
+        self.init_from_arrays(nodes, np.array(demands, dtype=int),
+                              np.array([edge[0] for edge in edges], dtype=np.int32),
+                              np.array([edge[1] for edge in edges], dtype=np.int32),
+                              np.array(costs, dtype=int), np.array(lower_capacities, dtype=int),
+                              np.array(upper_capacities, dtype=int), edges)
+
+    # Set up the instance from edge indexed arrays, the arrays are used as they are without being copied
+    def init_from_arrays(self, nodes: int, demands: np.ndarray, tails: np.ndarray, heads: np.ndarray,
+                         costs: np.ndarray, lower_capacities: np.ndarray, upper_capacities: np.ndarray,
+                         edges: list[tuple[int, int]] = None):
         self.n = nodes
-        self.demands = np.array(demands, dtype=int)
-        self.m = len(edges)
-        self.edges = edges
-        self.costs = np.array(costs, dtype=int)
-        self.lower_capacities = np.array(lower_capacities, dtype=int)
-        self.upper_capacities = np.array(upper_capacities, dtype=int)
+        self.demands = demands
+        self.m = len(tails)
+        self._edges = edges # Built from tails and heads on first access when not given
+        self.costs = costs
+        self.lower_capacities = lower_capacities
+        self.upper_capacities = upper_capacities
         self.C = np.max(np.abs(self.costs))
         self.U = max(np.max(np.abs(self.lower_capacities)), np.max(np.abs(self.upper_capacities)))
         self.alpha = 1 / np.log2(1000 * self.m * self.U)
-        self.B = np.zeros((self.m, self.n), dtype=int) # Edge incidence matrix
-        for edge_idx in range(self.m):
-            u, v = edges[edge_idx]
-            self.B[edge_idx, u] = 1
-            self.B[edge_idx, v] = -1
-        self.undirected_edge_index_map = {} # Map that stores the undirected mapping of edges to their indices
-        for edge_idx in range(self.m):
-            self.add_edge_to_undirected_map(self.edges[edge_idx], edge_idx)
+        # Sparse edge incidence storage, edge e goes from tails[e] to heads[e]
+        self.tails = tails
+        self.heads = heads
+        self._B = None # Lazily built CSR view of the edge incidence matrix
+        self._B_csc = None # Lazily built CSC view of the edge incidence matrix
+        self._undirected_edge_index_map = None # Map that stores the undirected mapping of edges to their indices
         self.min_ratio_cycle_finder = None
+        self._potential_buffers = {} # Work buffers of the potential evaluations by dtype, allocated on first use
+        # Number of trailing edges that the initial point method added to or from its auxiliary vertex, the last one
+        self.auxiliary_edges = 0
+
+    # List of the (tail, head) tuples of all edges, built on first access
+    @property
+    def edges(self) -> list[tuple[int, int]]:
+        if self._edges is None:
+            self._edges = list(zip(self.tails.tolist(), self.heads.tolist()))
+        return self._edges
+
+    # Map from (u, v) to the indices of all edges between u and v in either direction, built on first access
+    @property
+    def undirected_edge_index_map(self) -> dict[tuple[int, int], list[int]]:
+        if self._undirected_edge_index_map is None:
+            self._undirected_edge_index_map = {}
+            for edge_idx, edge in enumerate(self.edges):
+                self.add_edge_to_undirected_map(edge, edge_idx)
+        return self._undirected_edge_index_map
 
     def display_instance(self):
         print(f"Instance with n = {self.n}, m = {self.m}")
@@ -39,16 +69,69 @@ class MinCostFlow:
     def display_edge_incidence_matrix_B(self):
         print(f"Edge incidence matrix: ")
         print(f"{'vertices:': >10} ", ' '.join([f"{i: >2}" for i in range(self.n)]))
-        for e, row in enumerate(self.B):
+        row = np.zeros(self.n, dtype=int)
+        for e in range(self.m): # Only a single row is materialised at a time
+            row[self.tails[e]] = 1
+            row[self.heads[e]] = -1
             print(f"{e: <2} {str(self.edges[e]): <7}", row)
+            row[self.tails[e]] = 0
+            row[self.heads[e]] = 0
+
+    # Edge incidence matrix B (m x n) in CSR format, built on first access
+    @property
+    def B(self) -> sp.csr_matrix:
+        if self._B is None:
+            rows = np.repeat(np.arange(self.m, dtype=np.int32), 2)
+            cols = np.column_stack((self.tails, self.heads)).ravel()
+            data = np.tile(np.array([1, -1], dtype=np.int8), self.m)
+            self._B = sp.csr_matrix((data, (rows, cols)), shape=(self.m, self.n))
+        return self._B
+
+    # Edge incidence matrix B (m x n) in CSC format, built on first access
+    @property
+    def B_csc(self) -> sp.csc_matrix:
+        if self._B_csc is None:
+            self._B_csc = self.B.tocsc()
+        return self._B_csc
+
+    # Entry of the edge incidence matrix B for the given edge and vertex
+    def incidence(self, edge_idx: int, vertex: int) -> int:
+        if self.tails[edge_idx] == vertex:
+            return 1
+        if self.heads[edge_idx] == vertex:
+            return -1
+        return 0
+
+    # Calculate B^T f, the net flow leaving every vertex, without building B
+    def find_demand_residuals(self, flow: np.ndarray) -> np.ndarray:
+        out_flow = np.bincount(self.tails, weights=flow, minlength=self.n)
+        in_flow = np.bincount(self.heads, weights=flow, minlength=self.n)
+        return out_flow - in_flow
+
+    # Check whether the flow respects all capacities and meets every demand
+    def is_feasible_flow(self, flow: np.ndarray) -> bool:
+        if np.any(flow < self.lower_capacities) or np.any(flow > self.upper_capacities):
+            return False
+        return np.array_equal(self.find_demand_residuals(flow), self.demands)
+
+    # Lower and upper bound on the cost of any flow within the capacities, taking every edge at its cheapest and its
+    # most expensive capacity
+    def find_cost_bounds(self) -> tuple[int, int]:
+        lower_costs = self.costs * self.lower_capacities
+        upper_costs = self.costs * self.upper_capacities
+        return int(np.sum(np.minimum(lower_costs, upper_costs))), int(np.sum(np.maximum(lower_costs, upper_costs)))
+
+    # Drop the cached sparse views after the graph has been modified
+    def invalidate_incidence_views(self):
+        self._B = None
+        self._B_csc = None
 
     # Calculate the potential function of the flow, phi as specified in the paper
     def find_phi(self, flow: np.ndarray, optimal_flow_cost: int) -> float:
         flow_cost = np.dot(self.costs, flow)
         first = 20 * self.m * np.log2(flow_cost - optimal_flow_cost)
-        left = (self.upper_capacities - flow) ** (-self.alpha)
-        right = (flow - self.lower_capacities) ** (-self.alpha)
-        sigma = np.sum(left + right)
+        buffers = self.find_slack_powers(flow)
+        sigma = np.sum(np.add(buffers.upper_powers, buffers.lower_powers, out=buffers.upper_terms))
         return first + sigma
 
     # Calculate the lengths of the flow as specified in the paper
@@ -67,27 +150,122 @@ class MinCostFlow:
         third = -self.alpha * (flow - self.lower_capacities) ** exponent
         return first + second + third
 
+    # Calculate phi, the gradients and the lengths of the flow together from the shared slack powers, writing all
+    # intermediate values into the work buffers of the instance. The returned arrays are views into those buffers,
+    # valid until the next evaluation. With dtype np.float32 the per edge terms are computed in single precision,
+    # phi is still summed in double
+    def find_potential(self, flow: np.ndarray, optimal_flow_cost: int, dtype=np.float64):
+        flow_cost = np.dot(self.costs, flow)
+        buffers = self.find_slack_powers(flow, dtype)
+        phi = 20 * self.m * np.log2(flow_cost - optimal_flow_cost) + np.sum(
+            np.add(buffers.upper_powers, buffers.lower_powers, out=buffers.gradients), dtype=np.float64)
+        self.find_barrier_terms(flow, out=(buffers.gradients, buffers.lengths), dtype=dtype)
+        np.multiply(self.costs, 20 * self.m * ((flow_cost - optimal_flow_cost) ** (-1)), out=buffers.upper_terms,
+                    casting="same_kind")
+        buffers.gradients += buffers.upper_terms
+        return phi, buffers.gradients, buffers.lengths
+
+    # Calculate the barrier part of the gradients, which only depends on the flow of each edge, together with the
+    # lengths, for all edges or only for the given edge indices. For all edges the slack powers are shared with the
+    # other evaluations of the same flow and the results are written into the given out arrays when passed
+    def find_barrier_terms(self, flow: np.ndarray, edges: np.ndarray = None, out: tuple = None, dtype=np.float64):
+        if edges is not None:
+            exponent = -1 - self.alpha
+            first = (self.upper_capacities[edges] - flow[edges]) ** exponent
+            second = (flow[edges] - self.lower_capacities[edges]) ** exponent
+            return self.alpha * (first - second), first + second
+        buffers = self.find_slack_powers(flow, dtype)
+        # The -1 - alpha powers are the -alpha powers divided by the slacks once more
+        np.divide(buffers.upper_powers, buffers.upper_slacks, out=buffers.upper_terms)
+        np.divide(buffers.lower_powers, buffers.lower_slacks, out=buffers.lower_terms)
+        barrier_gradients, lengths = out if out is not None else (np.empty(self.m, dtype), np.empty(self.m, dtype))
+        np.subtract(buffers.upper_terms, buffers.lower_terms, out=barrier_gradients, casting="same_kind")
+        barrier_gradients *= self.alpha
+        np.add(buffers.upper_terms, buffers.lower_terms, out=lengths, casting="same_kind")
+        return barrier_gradients, lengths
+
+    # Work buffers for the given dtype, reallocated whenever the number of edges changed
+    def potential_buffers(self, dtype=np.float64):
+        buffers = self._potential_buffers.get(np.dtype(dtype))
+        if buffers is None or len(buffers.lengths) != self.m:
+            buffers = PotentialBuffers(self.m, dtype)
+            self._potential_buffers[np.dtype(dtype)] = buffers
+        return buffers
+
+    # Write the slacks u - f and f - l of the flow and their -alpha powers into the work buffers, unless the buffers
+    # already hold them for the same flow, capacity arrays and alpha. Call reset_potential_cache after changing the
+    # capacities in place
+    def find_slack_powers(self, flow: np.ndarray, dtype=np.float64):
+        buffers = self.potential_buffers(dtype)
+        key = (self.alpha, self.lower_capacities, self.upper_capacities)
+        if buffers.key is not None and all(a is b for a, b in zip(buffers.key, key)) and \
+                np.array_equal(buffers.flow, flow):
+            return buffers
+        np.subtract(self.upper_capacities, flow, out=buffers.upper_slacks, casting="same_kind")
+        np.subtract(flow, self.lower_capacities, out=buffers.lower_slacks, casting="same_kind")
+        np.power(buffers.upper_slacks, -self.alpha, out=buffers.upper_powers)
+        np.power(buffers.lower_slacks, -self.alpha, out=buffers.lower_powers)
+        buffers.flow[:] = flow
+        buffers.key = key
+        return buffers
+
+    # Forget the slack powers of the last evaluated flow
+    def reset_potential_cache(self):
+        for buffers in self._potential_buffers.values():
+            buffers.key = None
+
+    # Independent copy of the instance, much cheaper than copy.deepcopy on large graphs
+    def copy(self):
+        I = copy.copy(self)
+        I.demands = self.demands.copy()
+        I._edges = list(self._edges) if self._edges is not None else None
+        I.costs = self.costs.copy()
+        I.lower_capacities = self.lower_capacities.copy()
+        I.upper_capacities = self.upper_capacities.copy()
+        I.tails = self.tails.copy()
+        I.heads = self.heads.copy()
+        if self._undirected_edge_index_map is not None:
+            I._undirected_edge_index_map = {key: list(indices)
+                                            for key, indices in self._undirected_edge_index_map.items()}
+        I.min_ratio_cycle_finder = None
+        I._potential_buffers = {}
+        return I
+
     # Add a vertex to the end of the graph
     def add_vertex(self) -> int:
         self.n += 1
         self.demands = np.append(self.demands, 0)
-        self.B = np.pad(self.B, ((0, 0), (0, 1)))
+        self.invalidate_incidence_views()
         return self.n - 1
 
     # Add an edge from u to v with a given cost, lower capacity and upper capacity
     def add_edge(self, u: int, v: int, cost: int, lower_capacity: int, upper_capacity: int):
-        self.edges.append((u, v))
-        self.add_edge_to_undirected_map((u, v), len(self.edges) - 1)
-        self.m += 1
-        self.costs = np.append(self.costs, cost)
-        self.C = max(self.C, cost)
-        self.lower_capacities = np.append(self.lower_capacities, lower_capacity)
-        self.upper_capacities = np.append(self.upper_capacities, upper_capacity)
-        self.U = max(self.U, abs(lower_capacity), abs(upper_capacity))
+        self.add_edges([u], [v], [cost], [lower_capacity], [upper_capacity])
+
+    # Add a batch of edges, edge i going from us[i] to vs[i], with a single copy of every edge array
+    def add_edges(self, us, vs, costs, lower_capacities, upper_capacities):
+        us = np.asarray(us, dtype=np.int32)
+        vs = np.asarray(vs, dtype=np.int32)
+        if len(us) == 0:
+            return
+        first_idx = self.m
+        if self._edges is not None or self._undirected_edge_index_map is not None: # Only lists that already exist
+            new_edges = list(zip(us.tolist(), vs.tolist()))
+            if self._edges is not None:
+                self._edges.extend(new_edges)
+            if self._undirected_edge_index_map is not None:
+                for offset, edge in enumerate(new_edges):
+                    self.add_edge_to_undirected_map(edge, first_idx + offset)
+        self.m += len(us)
+        self.costs = np.concatenate((self.costs, costs))
+        self.C = max(self.C, np.max(np.abs(costs)))
+        self.lower_capacities = np.concatenate((self.lower_capacities, lower_capacities))
+        self.upper_capacities = np.concatenate((self.upper_capacities, upper_capacities))
+        self.U = max(self.U, np.max(np.abs(lower_capacities)), np.max(np.abs(upper_capacities)))
         self.alpha = 1 / np.log2(1000 * self.m * self.U)
-        self.B = np.pad(self.B, ((0, 1), (0, 0)))
-        self.B[-1, u] = 1
-        self.B[-1, v] = -1
+        self.tails = np.concatenate((self.tails, us))
+        self.heads = np.concatenate((self.heads, vs))
+        self.invalidate_incidence_views()
 
     # Handles adding an edge to the map storing the undirected edge-index mapping
     def add_edge_to_undirected_map(self, edge, edge_index):
@@ -99,6 +277,27 @@ class MinCostFlow:
         self.undirected_edge_index_map[(u, v)].append(edge_index)
         self.undirected_edge_index_map[(v, u)].append(edge_index)
 
+    # Construct a min cost flow instance directly from edge indexed arrays, without copying them
+    @staticmethod
+    def from_arrays(nodes: int, demands: np.ndarray, tails: np.ndarray, heads: np.ndarray, costs: np.ndarray,
+                    lower_capacities: np.ndarray, upper_capacities: np.ndarray):
+        I = MinCostFlow.__new__(MinCostFlow)
+        I.init_from_arrays(nodes, demands, tails, heads, costs, lower_capacities, upper_capacities)
+        return I
+
+    # Write the instance in the columnar binary format: a directory with a json header and one .npy file per column
+    def to_binary(self, path: str):
+        write_binary(path, {"format": "min_cost_flow", "n": int(self.n), "m": int(self.m)},
+                     {"demands": self.demands, "tails": self.tails, "heads": self.heads, "costs": self.costs,
+                      "lower_capacities": self.lower_capacities, "upper_capacities": self.upper_capacities})
+
+    # Construct a min cost flow instance from the columnar binary format,
+    # memory-mapping the columns read-only straight into the instance arrays unless mmap is False
+    @staticmethod
+    def from_binary(path: str, mmap: bool = True):
+        header, columns = read_binary(path, "min_cost_flow", mmap)
+        return MinCostFlow.from_arrays(header["n"], **columns)
+
     # Construct a min cost flow instance from a given json file
     @staticmethod
     def from_json(path: str):
@@ -108,3 +307,40 @@ class MinCostFlow:
                             edges=[(edge[0], edge[1]) for edge in data["edges"]], costs=data["costs"],
                             lower_capacities=data["lower_capacities"], upper_capacities=data["upper_capacities"])
             return I
+
+# Preallocated m sized arrays that the potential evaluations of an instance write their intermediate values into,
+# together with the flow, capacity arrays and alpha that the slack powers were computed for
+class PotentialBuffers:
+    def __init__(self, m: int, dtype=np.float64):
+        self.upper_slacks = np.empty(m, dtype=dtype)
+        self.lower_slacks = np.empty(m, dtype=dtype)
+        self.upper_powers = np.empty(m, dtype=dtype)
+        self.lower_powers = np.empty(m, dtype=dtype)
+        self.upper_terms = np.empty(m, dtype=dtype)
+        self.lower_terms = np.empty(m, dtype=dtype)
+        self.gradients = np.empty(m, dtype=dtype)
+        self.lengths = np.empty(m, dtype=dtype)
+        self.flow = np.empty(m, dtype=np.float64)
+        self.key = None
+
+BINARY_FORMAT_VERSION = 1
+
+# Write a header and named columns as a directory in the columnar binary format
+def write_binary(path: str, header: dict, columns: dict[str, np.ndarray]):
+    os.makedirs(path, exist_ok=True)
+    for name, column in columns.items():
+        np.save(os.path.join(path, f"{name}.npy"), np.ascontiguousarray(column))
+    with open(os.path.join(path, "header.json"), "w") as file:
+        json.dump({**header, "version": BINARY_FORMAT_VERSION, "columns": list(columns)}, file)
+
+# Read the header and columns of a directory in the columnar binary format, checking that it holds the expected format
+def read_binary(path: str, expected_format: str, mmap: bool = True) -> tuple[dict, dict[str, np.ndarray]]:
+    with open(os.path.join(path, "header.json"), "r") as file:
+        header = json.load(file)
+    if header.get("format") != expected_format:
+        raise ValueError(f"{path} holds a {header.get('format')} instance, expected {expected_format}")
+    if header.get("version") != BINARY_FORMAT_VERSION:
+        raise ValueError(f"Unsupported binary format version {header.get('version')} in {path}")
+    columns = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r" if mmap else None)
+               for name in header["columns"]}
+    return header, columns
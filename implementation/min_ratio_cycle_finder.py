@@ -1,22 +1,200 @@
 import numpy as np
+import scipy.sparse as sp
+
+# Circulation matrices with a lower fraction of non-zeros than this are stored in sparse format
+SPARSE_DENSITY_THRESHOLD = 0.25
 
 # Class that stores all the circulations in the graph,
 # and finds the min ratio cycle in every iteration given the new gradients and lengths
 class MinRatioCycleFinder:
-    def __init__(self, circulations: list[np.ndarray]):
-        self.circulations = circulations
+    def __init__(self, circulations):
+        # All circulations are stacked as the rows of a single (number of circulations x m) matrix
+        if sp.issparse(circulations):
+            matrix = sp.csr_matrix(circulations, dtype=np.float64)
+        else:
+            matrix = np.asarray(circulations, dtype=np.float64)
+            if matrix.size > 0 and np.count_nonzero(matrix) < SPARSE_DENSITY_THRESHOLD * matrix.size:
+                matrix = sp.csr_matrix(matrix)
+        self.circulations = matrix
+        self.abs_circulations = abs(matrix)
+        self.row_keys = None # Keys of the stored circulations, see circulation_keys, built on first use
+
+    # Append more circulations as new rows of the stored matrix
+    def add_circulations(self, circulations):
+        if sp.issparse(self.circulations):
+            matrix = sp.vstack((self.circulations, sp.csr_matrix(circulations, dtype=np.float64)), format="csr")
+        else:
+            other = circulations.toarray() if sp.issparse(circulations) else np.asarray(circulations, dtype=np.float64)
+            matrix = np.vstack((self.circulations, other))
+        self.circulations = matrix
+        self.abs_circulations = abs(matrix)
+        if self.row_keys is not None:
+            self.row_keys.update(circulation_keys(circulations))
+
+    # Append only the circulations that are not stored yet in either direction, returns the number of added rows
+    def add_new_circulations(self, circulations) -> int:
+        if self.row_keys is None:
+            self.row_keys = set(circulation_keys(self.circulations))
+        rows = []
+        for row, key in enumerate(circulation_keys(circulations)):
+            if key not in self.row_keys:
+                self.row_keys.add(key)
+                rows.append(row)
+        if len(rows) > 0:
+            self.add_circulations(sp.csr_matrix(circulations, dtype=np.float64)[rows])
+        return len(rows)
+
+    # Number of stored circulations
+    def __len__(self):
+        return self.circulations.shape[0] if self.circulations.ndim == 2 else 0
+
+    # Get the circulation stored in the given row as a dense array
+    def get_circulation(self, idx: int) -> np.ndarray:
+        if sp.issparse(self.circulations):
+            return self.circulations[idx].toarray().ravel()
+        return self.circulations[idx].copy()
 
     def find_min_ratio_cycle(self, gradients: np.ndarray, lengths: np.ndarray):
-        min_ratio = float('inf')
-        min_ratio_cycle = np.zeros(0, dtype=np.float64)
-        for circulation in self.circulations:
-            for direction in [1.0, -1.0]:
-                delta = circulation * direction
-                gd = np.dot(gradients, delta)
-                ld = lengths * delta
-                norm = np.sum(np.abs(ld))
-                ratio = gd / norm
-                if ratio < min_ratio:
-                    min_ratio = ratio
-                    min_ratio_cycle = circulation
-        return min_ratio, min_ratio_cycle
+        if len(self) == 0:
+            return float('inf'), np.zeros(0, dtype=np.float64)
+        gd = self.circulations @ gradients # Gradient product of every circulation
+        norm = self.abs_circulations @ np.abs(lengths) # Weighted L1 norm, identical for both directions
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratios = np.column_stack((gd / norm, -gd / norm)).ravel() # Interleaved as (c0, -c0, c1, -c1, ...)
+        ratios[np.isnan(ratios)] = float('inf')
+        best = int(np.argmin(ratios)) # First occurrence of the minimum, same tie-breaking as a sequential scan
+        min_ratio = ratios[best]
+        if not min_ratio < float('inf'):
+            return float('inf'), np.zeros(0, dtype=np.float64)
+        return min_ratio, self.get_circulation(best // 2)
+
+# Fraction of the edges whose flow changed above which an update recomputes everything from scratch, and fraction of
+# the number of circulations above which the entries through the changed edges are rescored with a full product
+FULL_UPDATE_FRACTION = 0.1
+
+# Min ratio cycle finder that follows the flow of one instance across interior point iterations.
+# The gradient of an edge is the gap term 20m / (c^T f - F*) times its cost plus a barrier term of its own flow,
+# so the gradient product of every circulation is kept split as scale * (C costs) + (C barrier), next to its norm
+# |C| lengths. After an augmentation only the circulations through edges whose flow changed are rescored, found with
+# an edge to circulation index, and the gap term only changes the global scale
+class DynamicMinRatioCycleFinder(MinRatioCycleFinder):
+    def __init__(self, circulations):
+        super().__init__(circulations)
+        self.reset()
+
+    # Append more circulations, scoring only the new rows for the tracked flow
+    def add_circulations(self, circulations):
+        stored = len(self)
+        super().add_circulations(circulations)
+        self.edge_index = None
+        if self.flow is None:
+            return
+        added = self.circulations[stored:]
+        self.cost_products = np.concatenate((self.cost_products, added @ self.instance_state[1].astype(np.float64)))
+        self.barrier_products = np.concatenate((self.barrier_products, added @ self.barrier_gradients))
+        self.norms = np.concatenate((self.norms, abs(added) @ np.abs(self.lengths)))
+
+    # Forget the tracked flow, so that the next update rescores every circulation
+    def reset(self):
+        self.edge_index = None # Circulations through every edge, as a CSC matrix built on first use
+        self.flow = None
+        self.instance_state = None
+        self.barrier_gradients = None
+        self.lengths = None
+        self.cost_products = None
+        self.barrier_products = None
+        self.norms = None
+        self.scale = None
+
+    # Track the given flow of the instance, rescoring only the circulations that it changed since the last update
+    def update(self, I, flow: np.ndarray, optimal_flow_cost: int) -> int:
+        if self.flow is None or not self.matches(I):
+            rescored = self.full_update(I, flow)
+        else:
+            changed = np.nonzero(flow != self.flow)[0]
+            if len(changed) > FULL_UPDATE_FRACTION * I.m:
+                rescored = self.full_update(I, flow)
+            else:
+                rescored = self.partial_update(I, flow, changed)
+        self.scale = 20 * I.m * ((np.dot(I.costs, flow) - optimal_flow_cost) ** (-1))
+        return rescored
+
+    # Whether the scores were computed for the same costs, capacities and alpha of the instance.
+    # Arrays are compared by identity, call reset after changing them in place
+    def matches(self, I) -> bool:
+        alpha, costs, lower_capacities, upper_capacities = self.instance_state
+        return (alpha == I.alpha and costs is I.costs and lower_capacities is I.lower_capacities
+                and upper_capacities is I.upper_capacities)
+
+    def full_update(self, I, flow: np.ndarray) -> int:
+        self.instance_state = (I.alpha, I.costs, I.lower_capacities, I.upper_capacities)
+        self.flow = flow.copy()
+        out = None
+        if self.lengths is not None and len(self.lengths) == I.m: # Overwrite the arrays of the previous full update
+            out = (self.barrier_gradients, self.lengths)
+        self.barrier_gradients, self.lengths = I.find_barrier_terms(flow, out=out)
+        self.cost_products = self.circulations @ I.costs.astype(np.float64)
+        self.barrier_products = self.circulations @ self.barrier_gradients
+        self.norms = self.abs_circulations @ np.abs(self.lengths)
+        return len(self)
+
+    def partial_update(self, I, flow: np.ndarray, changed: np.ndarray) -> int:
+        if len(changed) == 0:
+            return 0
+        if self.edge_index is None:
+            self.edge_index = sp.csc_matrix(self.circulations)
+        self.flow[changed] = flow[changed]
+        self.barrier_gradients[changed], self.lengths[changed] = I.find_barrier_terms(flow, changed)
+        indptr = self.edge_index.indptr
+        touched_entries = np.sum(indptr[changed + 1] - indptr[changed])
+        if touched_entries > FULL_UPDATE_FRACTION * len(self) or not sp.issparse(self.circulations):
+            # Rescoring most rows is cheapest as a plain product, and a dense matrix has no row structure to exploit
+            self.barrier_products = self.circulations @ self.barrier_gradients
+            self.norms = self.abs_circulations @ np.abs(self.lengths)
+            return len(self)
+        is_touched = np.zeros(len(self), dtype=bool)
+        is_touched[self.edge_index.indices[gather_ranges(indptr, changed)[0]]] = True
+        rows = np.flatnonzero(is_touched)
+        positions, labels = gather_ranges(self.circulations.indptr, rows)
+        columns = self.circulations.indices[positions]
+        gradient_terms = self.circulations.data[positions] * self.barrier_gradients[columns]
+        length_terms = self.abs_circulations.data[positions] * np.abs(self.lengths[columns])
+        self.barrier_products[rows] = np.bincount(labels, gradient_terms, minlength=len(rows))
+        self.norms[rows] = np.bincount(labels, length_terms, minlength=len(rows))
+        return len(rows)
+
+    # Find the min ratio cycle for the tracked flow, returning its ratio, the circulation and its gradient product
+    def find_tracked_min_ratio_cycle(self):
+        if len(self) == 0:
+            return float('inf'), np.zeros(0, dtype=np.float64), 0.0
+        gd = self.scale * self.cost_products + self.barrier_products
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratios = np.column_stack((gd / self.norms, -gd / self.norms)).ravel()
+        ratios[np.isnan(ratios)] = float('inf')
+        best = int(np.argmin(ratios))
+        min_ratio = ratios[best]
+        if not min_ratio < float('inf'):
+            return float('inf'), np.zeros(0, dtype=np.float64), 0.0
+        return min_ratio, self.get_circulation(best // 2), gd[best // 2]
+
+# Hashable key of every row of a circulation matrix, equal for a circulation and its reverse
+def circulation_keys(circulations) -> list[bytes]:
+    matrix = sp.csr_matrix(circulations, dtype=np.float64).sorted_indices()
+    keys = []
+    for row in range(matrix.shape[0]):
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        data = matrix.data[start:end]
+        if end > start and data[0] < 0: # Orient every circulation so that its lowest edge is used forwards
+            data = -data
+        keys.append(matrix.indices[start:end].astype(np.int64).tobytes() + data.tobytes())
+    return keys
+
+# Positions of the entries of the given rows of a compressed sparse matrix with the given index pointer,
+# together with the position in `rows` of the row every entry belongs to
+def gather_ranges(indptr: np.ndarray, rows: np.ndarray):
+    starts = indptr[rows]
+    counts = indptr[rows + 1] - starts
+    labels = np.repeat(np.arange(len(rows)), counts)
+    offsets = np.cumsum(counts) - counts
+    positions = np.arange(len(labels)) - offsets[labels] + starts[labels]
+    return positions, labels
@@ -1,96 +1,308 @@
-from itertools import combinations
+from collections import deque
+from itertools import combinations, product
 
 import networkx as nx
 import numpy as np
+import scipy.sparse as sp
 
-from min_cost_flow import MinCostFlow
-from min_ratio_cycle_finder import MinRatioCycleFinder
+from implementation import instrumentation
+from implementation.circulation_cache import circulation_cache
+from implementation.min_cost_flow import MinCostFlow
+from implementation.min_ratio_cycle_finder import DynamicMinRatioCycleFinder
 
-# Find the min ratio cycle for a given instance using the current flow and the optimal cost value
-def find_min_ratio_cycle(I: MinCostFlow, flow: np.ndarray, optimal_flow_cost: int):
-    gradients = I.find_gradients(flow, optimal_flow_cost)
-    lengths = I.find_lengths(flow)
-    if I.min_ratio_cycle_finder is None: # Find and store all the circulations upon instantiation
-        cycles = find_all_cycles(I)
-        # print(f"Found {len(cycles)} cycles")
-        circulations = get_circulations(I, cycles)
-        I.min_ratio_cycle_finder = MinRatioCycleFinder(circulations)
-    min_ratio, min_ratio_cycle = I.min_ratio_cycle_finder.find_min_ratio_cycle(gradients, lengths)
+# Strategies for generating the candidate circulations:
+# "all_cycles" enumerates every simple cycle of the graph (exponential in the worst case),
+# "spanning_tree" uses the m - n + 1 fundamental cycles of a BFS spanning forest, and adds the fundamental
+# cycles of a minimum spanning forest with respect to the current lengths whenever those get stuck,
+# skipping the cycles that are already stored
+CYCLE_STRATEGIES = ("all_cycles", "spanning_tree")
+
+# Find the min ratio cycle for a given instance using the current flow and the optimal cost value.
+# The finder stored on the instance tracks the flow between calls, so only circulations through edges whose flow
+# changed since the previous call are rescored
+def find_min_ratio_cycle(I: MinCostFlow, flow: np.ndarray, optimal_flow_cost: int, strategy: str = "all_cycles",
+                         current_phi: float = None):
+    if I.min_ratio_cycle_finder is None: # Find and store all the circulations upon instantiation, unless cached
+        circulations = find_cached_circulations(I, strategy)
+        I.min_ratio_cycle_finder = DynamicMinRatioCycleFinder(circulations)
+    min_ratio, step = find_step(I, flow, optimal_flow_cost, strategy, current_phi)
+    if strategy == "spanning_tree" and not np.any(step):
+        # Every candidate is blocked by an almost saturated edge, retry with cycles of a tree avoiding long edges
+        lengths = I.min_ratio_cycle_finder.lengths # Lengths of the current flow, tracked by the finder
+        if I.min_ratio_cycle_finder.add_new_circulations(find_fundamental_circulations(I, lengths)) > 0:
+            min_ratio, step = find_step(I, flow, optimal_flow_cost, strategy, current_phi)
+    return min_ratio, step
+
+# Find the augmenting step along the min ratio cycle among the stored circulations
+def find_step(I: MinCostFlow, flow: np.ndarray, optimal_flow_cost: int, strategy: str, current_phi: float = None):
+    finder = I.min_ratio_cycle_finder
+    if len(finder) == 0: # The graph has no cycles, so the flow cannot change
+        return float('inf'), np.zeros(I.m)
+    rescored = finder.update(I, flow, optimal_flow_cost)
+    min_ratio, min_ratio_cycle, gd = finder.find_tracked_min_ratio_cycle()
+    if instrumentation.tracer is not None:
+        instrumentation.tracer.count("cycles_scored", 2 * len(finder))
+        instrumentation.tracer.count("circulations_rescored", rescored)
     assert min_ratio_cycle is not None and min_ratio < float('inf'), "No min ratio cycle found"
-    gd = gradients.dot(min_ratio_cycle)
     eta = -10 / gd  # TODO: Scale according to the paper
-    return min_ratio, min_ratio_cycle * eta
-
-# Convert all the cycles stored into circulations
-def get_circulations(I: MinCostFlow, cycles: list[list[int]]) -> list[np.ndarray]:
-    circulations = []
-    for cycle in cycles:
-        circulation = np.zeros(I.m, dtype=np.float64)
-        for idx in range(len(cycle)):
-            edge = cycle[idx]
-            nex = cycle[(idx + 1) % len(cycle)]
+    step = min_ratio_cycle * eta
+    if strategy == "spanning_tree": # Fundamental cycles are long, so the raw step has to be damped
+        step = damp_step(I, flow, step, optimal_flow_cost, current_phi)
+    return min_ratio, step
+
+# Keep the step strictly inside the capacities and halve it until it decreases the potential phi,
+# or closes the gap to the optimal cost. Returns a zero step if no such step exists.
+# The potential of the current flow is computed unless the caller already knows it
+def damp_step(I: MinCostFlow, flow: np.ndarray, step: np.ndarray, optimal_flow_cost: int, current_phi: float = None,
+              fraction: float = 0.5, max_halvings: int = 30) -> np.ndarray:
+    moving = step != 0
+    if not np.any(moving):
+        return step
+    room = np.where(step > 0, I.upper_capacities - flow, flow - I.lower_capacities)
+    step = step * min(1.0, fraction * np.min(room[moving] / np.abs(step[moving])))
+    if current_phi is None:
+        current_phi = I.find_phi(flow, optimal_flow_cost)
+    with np.errstate(invalid='ignore'):
+        for _ in range(max_halvings):
+            new_flow = flow + step
+            if np.dot(I.costs, new_flow) <= optimal_flow_cost or I.find_phi(new_flow, optimal_flow_cost) < current_phi:
+                return step
+            step = step / 2
+    return np.zeros_like(step)
+
+# Find the candidate circulations of the given instance using the given strategy
+def find_circulations(I: MinCostFlow, strategy: str = "all_cycles") -> sp.csr_matrix:
+    if strategy == "all_cycles":
+        cycles = find_all_cycles(I)
+        # print(f"Found {len(cycles)} cycles")
+        return get_circulations(I, cycles)
+    if strategy == "spanning_tree":
+        return find_fundamental_circulations(I)
+    raise ValueError(f"Unknown cycle strategy {strategy!r}, expected one of {CYCLE_STRATEGIES}")
+
+# Find the candidate circulations of the given instance, looking them up in the cache by topology unless cache is None.
+# For a feasible instance of the initial point method the circulations of the original graph and those through the
+# auxiliary vertex, see find_auxiliary_circulations, are cached separately. The latter are cached with every auxiliary
+# edge pointing into the auxiliary vertex, so flipping the sign of the excess of a node only flips a column sign
+def find_cached_circulations(I: MinCostFlow, strategy: str = "all_cycles", cache=circulation_cache) -> sp.csr_matrix:
+    if I.auxiliary_edges == 0:
+        return find_circulations(I, strategy) if cache is None else cache.get_or_compute(I, strategy, find_circulations)
+    original_m = I.m - I.auxiliary_edges
+    auxiliary_vertex = I.n - 1
+    original = sp.csr_matrix((0, original_m))
+    if original_m > 0:
+        I_original = MinCostFlow.from_arrays(I.n - 1, I.demands[:-1], I.tails[:original_m], I.heads[:original_m],
+                                             I.costs[:original_m], I.lower_capacities[:original_m],
+                                             I.upper_capacities[:original_m])
+        original = find_cached_circulations(I_original, strategy, cache)
+    original = sp.csr_matrix((original.data, original.indices, original.indptr), shape=(original.shape[0], I.m))
+    into_root = I.heads[original_m:] == auxiliary_vertex
+    I_canonical = MinCostFlow.from_arrays(I.n, I.demands, np.concatenate((I.tails[:original_m], np.where(
+        into_root, I.tails[original_m:], I.heads[original_m:]))), np.concatenate((I.heads[:original_m], np.full(
+        I.auxiliary_edges, auxiliary_vertex))), I.costs, I.lower_capacities, I.upper_capacities)
+    I_canonical.auxiliary_edges = I.auxiliary_edges
+    if cache is None:
+        auxiliary = find_auxiliary_circulations(I_canonical, strategy)
+    else:
+        auxiliary = cache.get_or_compute(I_canonical, f"{strategy}:auxiliary",
+                                         lambda I_canonical, _: find_auxiliary_circulations(I_canonical, strategy))
+    signs = np.ones(I.m)
+    signs[original_m:][~into_root] = -1
+    return sp.vstack((original, auxiliary @ sp.diags(signs)), format="csr")
+
+# Find the circulations through the auxiliary vertex of a feasible instance, the last vertex, whose edges are the
+# trailing auxiliary_edges edges. Together with the circulations of the original graph they span all circulations:
+# "all_cycles" closes every simple path between two nodes with auxiliary edges through the auxiliary vertex,
+# "spanning_tree" uses the fundamental cycles through the auxiliary vertex of a BFS tree rooted at it,
+# which are short as every node with an auxiliary edge is a child of the root
+def find_auxiliary_circulations(I: MinCostFlow, strategy: str = "all_cycles") -> sp.csr_matrix:
+    original_m = I.m - I.auxiliary_edges
+    auxiliary_vertex = I.n - 1
+    if strategy == "spanning_tree":
+        parent, parent_edge, depth = root_forest(I, get_adjacency(I), [auxiliary_vertex])
+        top = np.full(I.n, -1, dtype=np.int64) # Child of the root that every reached vertex hangs below
+        for vertex in np.argsort(depth, kind="stable"):
+            if depth[vertex] > 0:
+                top[vertex] = vertex if depth[vertex] == 1 else top[parent[vertex]]
+        is_tree_edge = np.zeros(I.m, dtype=bool)
+        is_tree_edge[parent_edge[parent_edge >= 0]] = True
+        tails, heads = I.tails[:original_m], I.heads[:original_m]
+        through_root = ~is_tree_edge[:original_m] & (top[tails] >= 0) & (top[tails] != top[heads])
+        return tree_circulations(I, np.nonzero(through_root)[0], parent, parent_edge, depth)
+    if strategy != "all_cycles":
+        raise ValueError(f"Unknown cycle strategy {strategy!r}, expected one of {CYCLE_STRATEGIES}")
+    adjacency = get_adjacency(I, np.arange(I.m) < original_m)
+    auxiliary_edge = np.full(I.n, -1, dtype=np.int64) # Auxiliary edge of every node that has one
+    auxiliary_nodes = np.where(I.tails[original_m:] == auxiliary_vertex, I.heads[original_m:], I.tails[original_m:])
+    auxiliary_edge[auxiliary_nodes] = np.arange(original_m, I.m)
+    rows = []
+    cols = []
+    data = []
+    row = 0
+    for a in np.sort(auxiliary_nodes).tolist():
+        # Depth first search over the simple paths from a, closing every path that ends at a later node with an
+        # auxiliary edge into the cycle auxiliary vertex -> a -> ... -> b -> auxiliary vertex
+        path_nodes = [a]
+        path_edges = []
+        on_path = {a}
+        stack = [iter(adjacency[a])]
+        while stack:
+            step = next(stack[-1], None)
+            if step is None:
+                stack.pop()
+                on_path.discard(path_nodes.pop())
+                if path_edges:
+                    path_edges.pop()
+                continue
+            b, edge_idx = step
+            if b in on_path:
+                continue
+            path_edges.append(edge_idx)
+            if b > a and auxiliary_edge[b] >= 0:
+                cols.append(auxiliary_edge[a])
+                data.append(-I.incidence(auxiliary_edge[a], a))
+                for u, path_edge in zip(path_nodes, path_edges):
+                    cols.append(path_edge)
+                    data.append(I.incidence(path_edge, u))
+                cols.append(auxiliary_edge[b])
+                data.append(I.incidence(auxiliary_edge[b], b))
+                rows.extend([row] * (len(cols) - len(rows)))
+                row += 1
+            path_nodes.append(b)
+            on_path.add(b)
+            stack.append(iter(adjacency[b]))
+    return sp.csr_matrix((data, (rows, cols)), shape=(row, I.m), dtype=np.float64)
+
+# Find the edges of a spanning forest of the underlying undirected graph.
+# Without weights this is a BFS forest rooted at high degree vertices, which keeps the tree paths short,
+# with weights it is a minimum spanning forest found using Kruskal's algorithm
+def find_spanning_forest(I: MinCostFlow, weights: np.ndarray = None) -> np.ndarray:
+    is_tree_edge = np.zeros(I.m, dtype=bool)
+    if weights is not None:
+        component = list(range(I.n)) # Union-find parent pointers
+        def find(x):
+            while component[x] != x:
+                component[x] = component[component[x]]
+                x = component[x]
+            return x
+        for edge_idx in np.argsort(weights, kind="stable"):
+            a, b = find(int(I.tails[edge_idx])), find(int(I.heads[edge_idx]))
+            if a != b:
+                component[a] = b
+                is_tree_edge[edge_idx] = True
+        return is_tree_edge
+    adjacency = get_adjacency(I)
+    visited = np.zeros(I.n, dtype=bool)
+    for root in sorted(range(I.n), key=lambda vertex: -len(adjacency[vertex])):
+        if visited[root]:
+            continue
+        visited[root] = True
+        queue = deque([root])
+        while queue:
+            x = queue.popleft()
+            for y, edge_idx in adjacency[x]:
+                if not visited[y]:
+                    visited[y] = True
+                    is_tree_edge[edge_idx] = True
+                    queue.append(y)
+    return is_tree_edge
+
+# Neighbour and connecting edge index of every vertex of the underlying undirected graph
+def get_adjacency(I: MinCostFlow, edge_mask: np.ndarray = None) -> list[list[tuple[int, int]]]:
+    adjacency = [[] for _ in range(I.n)]
+    edge_indices = range(I.m) if edge_mask is None else np.nonzero(edge_mask)[0]
+    for edge_idx in edge_indices:
+        u, v = int(I.tails[edge_idx]), int(I.heads[edge_idx])
+        adjacency[u].append((v, int(edge_idx)))
+        adjacency[v].append((u, int(edge_idx)))
+    return adjacency
+
+# Find the fundamental circulations of a spanning forest of the underlying undirected graph, see find_spanning_forest.
+# Every non-tree edge closes exactly one cycle with the tree path between its endpoints,
+# these cycles form a basis of the cycle space and the total size is polynomial in n and m
+def find_fundamental_circulations(I: MinCostFlow, weights: np.ndarray = None) -> sp.csr_matrix:
+    is_tree_edge = find_spanning_forest(I, weights)
+    parent, parent_edge, depth = root_forest(I, get_adjacency(I, is_tree_edge), range(I.n))
+    return tree_circulations(I, np.nonzero(~is_tree_edge)[0], parent, parent_edge, depth)
+
+# Root the trees of a forest, given by its adjacency, at the first of the given roots they contain using BFS.
+# Returns the parent, the edge to the parent and the depth of every vertex, with depth -1 for vertices not reached
+def root_forest(I: MinCostFlow, adjacency: list[list[tuple[int, int]]], roots):
+    parent = np.full(I.n, -1, dtype=np.int64)
+    parent_edge = np.full(I.n, -1, dtype=np.int64)
+    depth = np.full(I.n, -1, dtype=np.int64)
+    for root in roots:
+        if depth[root] != -1:
+            continue
+        depth[root] = 0
+        queue = deque([root])
+        while queue:
+            x = queue.popleft()
+            for y, edge_idx in adjacency[x]:
+                if depth[y] == -1:
+                    depth[y] = depth[x] + 1
+                    parent[y] = x
+                    parent_edge[y] = edge_idx
+                    queue.append(y)
+    return parent, parent_edge, depth
+
+# Find the circulation that every given non-tree edge closes with the path between its endpoints in a rooted forest
+def tree_circulations(I: MinCostFlow, edges: np.ndarray, parent: np.ndarray, parent_edge: np.ndarray,
+                      depth: np.ndarray) -> sp.csr_matrix:
+    rows = []
+    cols = []
+    data = []
+    for row, edge_idx in enumerate(edges):
+        u, v = int(I.tails[edge_idx]), int(I.heads[edge_idx])
+        cols.append(edge_idx) # Send flow u -> v along the non-tree edge ...
+        data.append(1)
+        while depth[v] > depth[u]: # ... then back up from v towards the common ancestor ...
+            cols.append(parent_edge[v])
+            data.append(I.incidence(parent_edge[v], v))
+            v = parent[v]
+        while depth[u] > depth[v]: # ... and down from the common ancestor to u
+            cols.append(parent_edge[u])
+            data.append(-I.incidence(parent_edge[u], u))
+            u = parent[u]
+        while u != v:
+            cols.extend((parent_edge[v], parent_edge[u]))
+            data.extend((I.incidence(parent_edge[v], v), -I.incidence(parent_edge[u], u)))
+            v = parent[v]
+            u = parent[u]
+        rows.extend([row] * (len(cols) - len(rows)))
+    return sp.csr_matrix((data, (rows, cols)), shape=(len(edges), I.m), dtype=np.float64)
+
+# Convert all the cycles stored into circulations, stacked as the rows of a sparse matrix
+def get_circulations(I: MinCostFlow, cycles: list[list[int]]) -> sp.csr_matrix:
+    rows = []
+    cols = []
+    data = []
+    for row, cycle in enumerate(cycles):
+        # Walk around the cycle starting at the endpoint that the first edge shares with the last one, every edge is
+        # traversed away from the current vertex. With parallel edges both endpoints are shared, either one works
+        a, b = I.edges[cycle[0]]
+        vertex = a if a in I.edges[cycle[-1]] else b
+        for edge in cycle:
+            rows.append(row)
+            cols.append(edge)
+            data.append(I.incidence(edge, vertex))
             a, b = I.edges[edge]
-            if I.edges[nex][0] == a or I.edges[nex][1] == a:
-                circulation[edge] = I.B[edge, a]
-            else:
-                circulation[edge] = I.B[edge, b]
-        circulations.append(circulation)
-    return circulations
-
-# Find all the cycles in the given graph instance
+            vertex = b if vertex == a else a
+    return sp.csr_matrix((data, (rows, cols)), shape=(len(cycles), I.m), dtype=np.float64)
+
+# Find all the simple cycles of the given graph instance, as lists of edge indices. Every simple cycle of the
+# underlying simple graph is taken with every choice among the parallel edges along it, and every two parallel edges
+# form a cycle of length two
 def find_all_cycles(I: MinCostFlow):
-    G = nx.MultiGraph(I.edges)
-    visited_cycles = set()
     cycles = []
-    pair_cycles = []
-    for cycle in nx.simple_cycles(G):
-        cycle_edges = []
-        pair_edges = set()
-        for i in range(len(cycle)):
-            a = cycle[i]
-            b = cycle[(i + 1) % len(cycle)]
-            edges = I.undirected_edge_index_map[(a, b)]
-            if len(edges) > 1:
-                pair_edges.add(edges[0])
-            cycle_edges.append(edges[0])
-        if len(pair_edges) > 0:
-            pair_cycles.append((cycle_edges, pair_edges))
-        if len(cycle_edges) == 2 and cycle_edges[0] == cycle_edges[1]:
+    for cycle in nx.simple_cycles(nx.Graph(I.edges)):
+        if len(cycle) == 1: # Every self loop is a cycle on its own
+            cycles.extend([edge] for edge in dict.fromkeys(I.undirected_edge_index_map[(cycle[0], cycle[0])]))
             continue
-        check_if_visited(cycle_edges, visited_cycles, cycles)
-    cycles.extend(handle_pair_cycles(I, visited_cycles, pair_cycles))
+        parallel_edges = [I.undirected_edge_index_map[(cycle[i], cycle[(i + 1) % len(cycle)])]
+                          for i in range(len(cycle))]
+        cycles.extend(list(edges) for edges in product(*parallel_edges))
+    for (a, b), parallel_edges in I.undirected_edge_index_map.items():
+        if a < b:
+            cycles.extend(list(pair) for pair in combinations(parallel_edges, 2))
     return cycles
-
-# Handle cycles formed that include parallel edges
-def handle_pair_cycles(I: MinCostFlow, visited_cycles: set[list[int]], pair_cycles: list[tuple[list[int], set[int]]]):
-    cycles = []
-    for (cycle, pair_edges) in pair_cycles:
-        for amount_to_replace in range(1, len(pair_edges) + 1):
-            for edges_to_replace in combinations(pair_edges, amount_to_replace):
-                G = nx.MultiGraph(resolve_edges(I, cycle))
-                for new_cycle in nx.simple_cycles(G):
-                    cycle_edges = []
-                    for i in range(len(new_cycle)):
-                        a = new_cycle[i]
-                        b = new_cycle[(i + 1) % len(new_cycle)]
-                        edges = I.undirected_edge_index_map[(a, b)]
-                        edges = [e for e in edges if e not in edges_to_replace]
-                        cycle_edges.append(edges[0])
-                    if len(cycle_edges) == 2 and cycle_edges[0] == cycle_edges[1]:
-                        continue
-                    check_if_visited(cycle_edges, visited_cycles, cycles)
-        for edge in pair_edges:
-            a, b = I.edges[edge]
-            check_if_visited(I.undirected_edge_index_map[(a, b)], visited_cycles, cycles)
-    return cycles
-
-# Resolve the edge indices into their corresponding edges
-def resolve_edges(I: MinCostFlow, edge_indices: list[int]):
-    return [I.edges[a] for a in edge_indices]
-
-# Add the cycle to the list of cycles only if it is not visited
-def check_if_visited(cycle_edges, visited_cycles: set, cycles: list[int]):
-    sorted_cycle_edges = tuple(sorted(cycle_edges))
-    if sorted_cycle_edges not in visited_cycles:
-        visited_cycles.add(sorted_cycle_edges)
-        cycles.append(cycle_edges)
@@ -1,31 +1,54 @@
+import copy
+
 import networkx as nx
 import numpy as np
 
+from implementation import instrumentation
 from implementation.max_flow import MaxFlow
 from implementation.min_cost_flow import MinCostFlow
 
 # Solve the min cost flow problem using the networkx library's min_cost_flow method
 def find_min_cost_flow(I: MinCostFlow):
-    I.display_instance()
-    if sum(I.lower_capacities) != 0:
-        I = normalize_graph(I)
-    G = nx.DiGraph()
-    for idx in range(I.m):
-        u, v = I.edges[idx]
-        G.add_edge(u, v, capacity=I.upper_capacities[idx], weight=I.costs[idx])
-    for node in range(I.n):
-        G.nodes[node]['demand'] = -I.demands[node]
+    if instrumentation.tracer is not None:
+        instrumentation.tracer.instance("Instance", I)
+    I_normalized = normalize_graph(I) if np.any(I.lower_capacities) else I
+    G, first_hops = to_nx_graph(I_normalized)
     flow_dict = nx.min_cost_flow(G)
-    min_cost = nx.cost_of_flow(G, flow_dict)
-    min_cost_flow = np.zeros(I.m, dtype=int)
-    for u in flow_dict:
-        for v in flow_dict[u]:
-            edge_flow = flow_dict[u][v]
-            for idx in range(I.m):
-                if I.edges[idx] == (u, v):
-                    min_cost_flow[idx] = edge_flow
+    tails = I.tails.tolist()
+    min_cost_flow = np.array([flow_dict[tails[idx]][first_hops[idx]] for idx in range(I.m)], dtype=int)
+    min_cost_flow = denormalize_flow(I, min_cost_flow)
+    min_cost = np.dot(I.costs, min_cost_flow).item()
     return min_cost, min_cost_flow
 
+# Build the networkx graph of the instance in bulk. A DiGraph can hold a single edge per (u, v) pair, so every
+# further parallel edge, and every self loop, is split into u -> auxiliary vertex -> v, with the cost on its first half.
+# Also returns the head of the first half of every edge, the flow of edge idx is flow_dict[tails[idx]][first_hops[idx]]
+def to_nx_graph(I: MinCostFlow):
+    tails = I.tails.tolist()
+    heads = I.heads.tolist()
+    capacities = I.upper_capacities.tolist()
+    costs = I.costs.tolist()
+    edge_index = {} # Index of the edge that is added directly for every (u, v) pair
+    first_hops = []
+    edges = []
+    next_vertex = I.n
+    for idx in range(I.m):
+        u, v = tails[idx], heads[idx]
+        if u != v and (u, v) not in edge_index:
+            edge_index[(u, v)] = idx
+            edges.append((u, v, {"capacity": capacities[idx], "weight": costs[idx]}))
+            first_hops.append(v)
+        else:
+            edges.append((u, next_vertex, {"capacity": capacities[idx], "weight": costs[idx]}))
+            edges.append((next_vertex, v, {"capacity": capacities[idx], "weight": 0}))
+            first_hops.append(next_vertex)
+            next_vertex += 1
+    G = nx.DiGraph()
+    G.add_nodes_from((node, {"demand": -demand}) for node, demand in enumerate(I.demands.tolist()))
+    G.add_nodes_from(range(I.n, next_vertex), demand=0)
+    G.add_edges_from(edges)
+    return G, first_hops
+
 # Solve the max flow problem using the networkx library's method
 def find_max_flow(I: MaxFlow):
     I = I.to_min_cost_flow()
@@ -34,14 +57,20 @@ def find_max_flow(I: MaxFlow):
     max_flow = min_cost_flow[:-1]
     return max_flow_value, max_flow
 
-# Adjust the graph to have zero lower capacities because the networkx library does not support lower capacities
-def normalize_graph(I: MinCostFlow):
-    adjusted_edges = []
-    for idx in range(I.m):
-        u, v = I.edges[idx]
-        adjusted_capacity = I.upper_capacities[idx] - I.lower_capacities[idx]
-        adjusted_edges.append((u, v, adjusted_capacity, I.costs[idx]))
-        I.demands[u] += I.lower_capacities[idx]
-        I.demands[v] -= I.lower_capacities[idx]
-    I.edges = adjusted_edges
-    return I
+# Adjust the graph to have zero lower capacities because the networkx library does not support lower capacities.
+# Substituting f = f' + l gives capacities u - l and demands d - B^T l, the result is a new instance sharing the
+# edge arrays of the original one, which is left untouched
+def normalize_graph(I: MinCostFlow) -> MinCostFlow:
+    I_normalized = copy.copy(I)
+    I_normalized.demands = I.demands - I.find_demand_residuals(I.lower_capacities).astype(I.demands.dtype)
+    I_normalized.lower_capacities = np.zeros_like(I.lower_capacities)
+    I_normalized.upper_capacities = I.upper_capacities - I.lower_capacities
+    I_normalized.U = np.max(np.abs(I_normalized.upper_capacities))
+    I_normalized.alpha = 1 / np.log2(1000 * I_normalized.m * I_normalized.U)
+    I_normalized.min_ratio_cycle_finder = None
+    I_normalized._potential_buffers = {}
+    return I_normalized
+
+# Map a flow of the normalized instance back to a flow of the original instance I
+def denormalize_flow(I: MinCostFlow, flow: np.ndarray) -> np.ndarray:
+    return flow + I.lower_capacities
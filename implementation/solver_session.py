@@ -0,0 +1,102 @@
+import numpy as np
+
+from implementation import instrumentation
+from implementation.flow_rounding import round_to_optimal_flow
+from implementation.intial_point import find_initial_feasible_flow
+from implementation.min_cost_flow import MinCostFlow
+from implementation.static_algorithm import check_probes_per_round, search_min_cost_flow
+
+# Session that re-solves a min cost flow instance after small updates of its costs, upper capacities and demands,
+# reusing the feasible instance, interior flow and solution of the previous solve
+class SolverSession:
+    def __init__(self, I: MinCostFlow, cycle_strategy: str = "all_cycles", probes_per_round: int = 1,
+                 workers: int = None, exact_rounding: bool = True):
+        check_probes_per_round(probes_per_round, exact_rounding)
+        self.I = I.copy()
+        self.cycle_strategy = cycle_strategy
+        self.probes_per_round = probes_per_round
+        self.workers = workers
+        self.exact_rounding = exact_rounding
+        self.I_feasible = None
+        self.initial_flow = None # Start flow of the feasible instance
+        self.interior_flow = None
+        self.cost = None
+        self.flow = None
+        self.feasible_instance_stale = True # Whether the feasible instance no longer matches the instance
+
+    # Set the costs of the given edges
+    def update_costs(self, edges, costs):
+        self.I.costs[edges] = costs
+        self.I.C = np.max(np.abs(self.I.costs))
+        if self.I_feasible is not None:
+            self.I_feasible.costs[edges] = costs # The original edges come first in the feasible instance
+            self.I_feasible.C = np.max(np.abs(self.I_feasible.costs))
+            self.reset_finder()
+
+    # Set the upper capacities of the given edges. The feasible instance is updated in place as long as the interior
+    # flow stays strictly below the new capacities, which always holds when capacities are only increased
+    def update_upper_capacities(self, edges, upper_capacities):
+        I = self.I
+        I.upper_capacities[edges] = upper_capacities
+        I.U = max(np.max(np.abs(I.lower_capacities)), np.max(np.abs(I.upper_capacities)))
+        I.alpha = 1 / np.log2(1000 * I.m * I.U)
+        if self.I_feasible is None or np.any(self.interior_flow[edges] >= I.upper_capacities[edges]) or \
+                np.any(self.initial_flow[edges] >= I.upper_capacities[edges]):
+            self.feasible_instance_stale = True
+            return
+        I_feasible = self.I_feasible
+        I_feasible.upper_capacities[edges] = upper_capacities
+        I_feasible.costs[I.m:] = 4 * I.m * I.U ** 2 # Keep the new edges of the initial point method expensive enough
+        I_feasible.C = np.max(np.abs(I_feasible.costs))
+        I_feasible.U = max(np.max(np.abs(I_feasible.lower_capacities)), np.max(np.abs(I_feasible.upper_capacities)))
+        I_feasible.alpha = 1 / np.log2(1000 * I_feasible.m * I_feasible.U)
+        self.reset_finder()
+
+    # Make the min ratio cycle finder rescore all circulations and drop the cached slack powers after the feasible
+    # instance was changed in place
+    def reset_finder(self):
+        self.I_feasible.reset_potential_cache()
+        if self.I_feasible.min_ratio_cycle_finder is not None:
+            self.I_feasible.min_ratio_cycle_finder.reset()
+
+    # Set the demands of the given nodes
+    def update_demands(self, nodes, demands):
+        self.I.demands[nodes] = demands
+        self.feasible_instance_stale = True
+
+    # Solve the instance in its current state, returning the min cost and the corresponding flow
+    def solve(self):
+        I = self.I
+        min_possible_cost, max_possible_cost = I.find_cost_bounds()
+        best_cost = None
+        best_flow = None
+        if self.exact_rounding and self.flow is not None:
+            optimal_flow = round_to_optimal_flow(I, np.clip(self.flow, I.lower_capacities, I.upper_capacities))
+            if optimal_flow is not None:
+                tracer = instrumentation.tracer
+                if tracer is not None:
+                    tracer.emit("session_solve", mode="cancelled", upper_bound=None)
+                self.flow = optimal_flow.astype(np.float64)
+                self.cost = np.dot(I.costs, self.flow)
+                return self.cost, self.flow
+        if self.flow is None or self.feasible_instance_stale:
+            mode = "cold" if self.flow is None else "rebuilt"
+            self.I_feasible, self.initial_flow = find_initial_feasible_flow(I)
+            self.interior_flow = self.initial_flow
+        else:
+            mode = "warm"
+        if self.flow is not None:
+            clipped_flow = np.clip(self.flow, I.lower_capacities, I.upper_capacities)
+            if I.is_feasible_flow(clipped_flow):
+                best_cost, best_flow = np.dot(I.costs, clipped_flow), clipped_flow
+        self.feasible_instance_stale = False
+        tracer = instrumentation.tracer
+        if tracer is not None:
+            tracer.emit("session_solve", mode=mode, upper_bound=best_cost)
+        if best_cost is not None:
+            max_possible_cost = best_cost
+        self.cost, self.flow, self.interior_flow = search_min_cost_flow(
+            I, self.I_feasible, self.interior_flow, min_possible_cost, max_possible_cost, self.cycle_strategy,
+            self.probes_per_round, self.workers, gallop=best_cost is not None, best_cost=best_cost,
+            best_flow=best_flow, exact_rounding=self.exact_rounding, cold_flow=self.initial_flow)
+        return self.cost, self.flow
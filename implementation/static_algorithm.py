@@ -1,64 +1,295 @@
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
 import numpy as np
+import scipy.sparse as sp
 
+from implementation import instrumentation
+from implementation.flow_rounding import cancel_negative_cycles, round_to_feasible_flow, round_to_optimal_flow
 from implementation.intial_point import find_initial_feasible_flow
 from implementation.max_flow import MaxFlow
+from implementation.instrumentation import Tracer
 from implementation.min_cost_flow import MinCostFlow
-from implementation.min_ratio_cycles import find_min_ratio_cycle
+from implementation.min_ratio_cycle_finder import DynamicMinRatioCycleFinder
+from implementation.min_ratio_cycles import find_cached_circulations, find_min_ratio_cycle
+
+# Probes whose flow is rounded exactly afterwards stop at this gap to the optimal cost guess, or as soon as the cost
+# decrease over the last window of iterations is less than the given fraction of the decrease since the probe started
+EXACT_ROUNDING_THRESHOLD = 1.0
+EXACT_ROUNDING_MIN_PROGRESS = 0.1
+EXACT_ROUNDING_WINDOW = 50
+
+# Weight of the start flow of the feasible instance in the warm start of a probe, which keeps it away from the bounds
+WARM_START_MIX = 0.1
 
 # Solve the min cost flow problem given an optimal cost guess,
-# using an implementation similar to the static method as mentioned in the paper
+# using an implementation similar to the static method as mentioned in the paper.
+# With exact_rounding the final flow is rounded to a provably optimal integral flow, see flow_rounding
 def min_cost_flow_with_optimal_cost(I_original: MinCostFlow,
-                                    optimal_cost: int):
-    print("Initial instance: ")
-    I_original.display_instance()
+                                    optimal_cost: int,
+                                    cycle_strategy: str = "all_cycles",
+                                    exact_rounding: bool = True):
+    tracer = instrumentation.tracer
+    if tracer is not None:
+        tracer.instance("Initial instance", I_original)
     last_idx = I_original.m
     I, current_flow = find_initial_feasible_flow(I_original)
-    print("Feasible instance: ")
-    I.display_instance()
+    if tracer is not None:
+        tracer.instance("Feasible instance", I)
     # print(f"Initial feasible flow: {current_flow}")
-    # threshold = (I.m * I.U) ** -10 # Threshold given in the paper
-    threshold = 1e-5  # Taking a larger threshold to terminate faster
+    threshold = EXACT_ROUNDING_THRESHOLD if exact_rounding else 1e-5
+    min_progress = EXACT_ROUNDING_MIN_PROGRESS if exact_rounding else None
+    current_flow, _ = improve_flow(I, current_flow, optimal_cost, cycle_strategy, threshold, min_progress)
+    final_flow = round_to_optimal_flow(I_original, current_flow[:last_idx]) if exact_rounding else None
+    final_flow = np.round(current_flow[:last_idx]) if final_flow is None else final_flow.astype(np.float64)
+    final_cost = np.dot(I.costs[:last_idx], final_flow)
+    return final_cost, final_flow
+
+# Run the interior point method on the feasible instance from the given interior flow until the cost reaches the
+# guess or stalls. Returns the final flow and the last flow that was strictly inside the capacities
+def improve_flow(I: MinCostFlow, current_flow: np.ndarray, optimal_cost: int, cycle_strategy: str = "all_cycles",
+                 threshold: float = 1e-5, min_progress: float = None, window: int = EXACT_ROUNDING_WINDOW):
+    # threshold = (I.m * I.U) ** -10 # Threshold given in the paper, a larger threshold terminates faster
+    current_flow = current_flow.copy()
+    interior_flow = current_flow.copy()
     iteration = 0
     current_phi = I.find_phi(current_flow, optimal_cost)
-    while np.dot(I.costs, current_flow) - I.optimal_flow_cost >= threshold:
+    start_cost = window_cost = np.dot(I.costs, current_flow) # Cost at the start of the probe and the current window
+    tracer = instrumentation.tracer
+    if tracer is not None:
+        tracer.count("probes")
+        probe_start = time.perf_counter()
+    while np.dot(I.costs, current_flow) - optimal_cost >= threshold:
         iteration += 1
+        if tracer is not None:
+            iteration_start = time.perf_counter()
         # print("Iteration", iteration)
         # print("Current Φ(f) = ", current_phi)
         # print(f"Current flow = {current_flow}")
-        min_ratio, min_ratio_cycle = find_min_ratio_cycle(I, current_flow, optimal_cost)
+        min_ratio, min_ratio_cycle = find_min_ratio_cycle(I, current_flow, optimal_cost, cycle_strategy, current_phi)
         # print(f"Min ratio = {min_ratio})")
         # print(f"Min ratio cycle = {min_ratio_cycle}")
+        if not np.any(min_ratio_cycle): # No cycle can decrease the potential any further
+            break
         current_flow += min_ratio_cycle
         # print(f"New flow after augmenting = {current_flow}")
         current_phi = I.find_phi(current_flow, optimal_cost)
+        if tracer is not None:
+            tracer.emit("iteration", optimal_cost=optimal_cost, iteration=iteration, phi=current_phi,
+                        gap=np.dot(I.costs, current_flow) - optimal_cost, ratio=min_ratio,
+                        step_size=np.sum(np.abs(min_ratio_cycle)), seconds=time.perf_counter() - iteration_start)
         if not current_phi < float('inf'):
             # print("Phi is too large")
             break
-    final_cost = np.dot(I.costs[:last_idx], np.round(current_flow[:last_idx]))
-    return final_cost, np.round(current_flow[:last_idx])
+        interior_flow[:] = current_flow
+        if min_progress is not None and iteration % window == 0:
+            cost = np.dot(I.costs, current_flow)
+            if window_cost - cost <= min_progress * (start_cost - cost): # The interior point method stalls
+                break
+            window_cost = cost
+    if tracer is not None:
+        tracer.count("iterations", iteration)
+        tracer.emit("probe", optimal_cost=optimal_cost, iterations=iteration, cost=np.dot(I.costs, current_flow),
+                    seconds=time.perf_counter() - probe_start)
+    return current_flow, interior_flow
 
-# Guesses the optimal flow cost using binary search and solves the min cost flow problem instance
+# Guesses the optimal flow cost using binary search and solves the min cost flow problem instance,
+# evaluating probes_per_round guesses in parallel per round without exact_rounding
 def find_min_cost_flow(
-        I: MinCostFlow):
-    min_possible_cost = - I.C * I.U
-    max_possible_cost = I.C * I.U
-    found_cost = None
-    found_flow = None
-    l = min_possible_cost
-    r = max_possible_cost
-    while l < r:
-        mid = (l + r) // 2
-        found_cost, found_flow = min_cost_flow_with_optimal_cost(I, mid)
-        if found_cost > mid:
-            l = mid + 1
-        else:
-            r = mid
+        I: MinCostFlow,
+        cycle_strategy: str = "all_cycles",
+        probes_per_round: int = 1,
+        workers: int = None,
+        exact_rounding: bool = True):
+    check_probes_per_round(probes_per_round, exact_rounding)
+    tracer = instrumentation.tracer
+    if tracer is not None:
+        tracer.instance("Initial instance", I)
+    I_feasible, initial_flow = find_initial_feasible_flow(I)
+    if tracer is not None:
+        tracer.instance("Feasible instance", I_feasible)
+    min_possible_cost, max_possible_cost = I.find_cost_bounds()
+    found_cost, found_flow, _ = search_min_cost_flow(I, I_feasible, initial_flow, min_possible_cost, max_possible_cost,
+                                                     cycle_strategy, probes_per_round, workers,
+                                                     exact_rounding=exact_rounding)
     return found_cost, found_flow
 
+# Search the optimal cost of I within [l, r] by probing guesses on its feasible instance, starting from warm_flow.
+# Returns the cost and flow found and the cheapest interior flow, raises a ValueError if the instance is infeasible
+def search_min_cost_flow(I: MinCostFlow, I_feasible: MinCostFlow, warm_flow: np.ndarray, l: int, r: int,
+                         cycle_strategy: str = "all_cycles", probes_per_round: int = 1, workers: int = None,
+                         gallop: bool = False, best_cost=None, best_flow: np.ndarray = None,
+                         exact_rounding: bool = True, cold_flow: np.ndarray = None):
+    last_idx = I.m
+    found_flow = None # Flow of the cheapest successful guess, or of the last guess if none succeeded
+    found_mid = None
+    step = 1
+    threshold = EXACT_ROUNDING_THRESHOLD if exact_rounding else 1e-5
+    min_progress = EXACT_ROUNDING_MIN_PROGRESS if exact_rounding else None
+    cold_flow = warm_flow if cold_flow is None else cold_flow
+    pool = None
+    check_probes_per_round(probes_per_round, exact_rounding)
+    if probes_per_round > 1:
+        pool = ProbePool(I_feasible, cycle_strategy, workers or probes_per_round, threshold)
+
+    def evaluate(mids: list[int], start_flow: np.ndarray, min_progress: float):
+        if pool is None:
+            return [improve_flow(I_feasible, start_flow, mid, cycle_strategy, threshold, min_progress) for mid in mids]
+        return pool.evaluate(mids, start_flow, min_progress)
+
+    try:
+        while l < r:
+            if gallop:
+                mids = sorted(set(max(l, r - step * 2 ** i) for i in range(probes_per_round)))
+                step *= 2 ** probes_per_round
+            else:
+                mids = split_bracket(l, r, probes_per_round)
+            if warm_flow is cold_flow:
+                results = dict(zip(mids, evaluate(mids, cold_flow, min_progress)))
+                failed = []
+            else:
+                start_flow = (1 - WARM_START_MIX) * warm_flow + WARM_START_MIX * cold_flow
+                results = dict(zip(mids, evaluate(mids, start_flow, EXACT_ROUNDING_MIN_PROGRESS)))
+                failed = [mid for mid, (current_flow, _) in results.items()
+                          if np.dot(I_feasible.costs, current_flow) - mid >= threshold]
+            if failed: # Confirm the rejected guesses from the cold start
+                results.update(zip(failed, evaluate(failed, cold_flow, min_progress)))
+            for mid, (current_flow, interior_flow) in results.items():
+                if np.dot(I_feasible.costs, interior_flow) < np.dot(I_feasible.costs, warm_flow):
+                    warm_flow = interior_flow
+                if exact_rounding:
+                    optimal_flow = round_to_optimal_flow(I, current_flow[:last_idx])
+                    if optimal_flow is None:
+                        raise ValueError("The instance is infeasible, its demands cannot be met")
+                    optimal_flow = optimal_flow.astype(np.float64)
+                    return np.dot(I.costs, optimal_flow), optimal_flow, warm_flow
+                rounded_flow = np.round(current_flow[:last_idx])
+                rounded_cost = np.dot(I.costs, rounded_flow)
+                if np.dot(I_feasible.costs, current_flow) - mid >= threshold:
+                    l = max(l, mid + 1)
+                    gallop = False # The optimal cost is now bracketed from both sides
+                    if found_mid is None:
+                        found_flow = current_flow[:last_idx]
+                else:
+                    r = min(r, mid)
+                    if found_mid is None or mid < found_mid:
+                        found_flow, found_mid = current_flow[:last_idx], mid
+                if I.is_feasible_flow(rounded_flow) and (best_cost is None or rounded_cost < best_cost):
+                    best_cost, best_flow = rounded_cost, rounded_flow
+                    r = min(r, best_cost) # The optimal cost can be at most the cost of any feasible flow
+            l = min(l, r) # Guesses in the same round can disagree, trust the smallest successful one
+    finally:
+        if pool is not None:
+            pool.close()
+    if best_cost is None:
+        best_flow = round_to_feasible_flow(I, found_flow if found_flow is not None else warm_flow[:last_idx])
+        if best_flow is None:
+            raise ValueError("The instance is infeasible, its demands cannot be met")
+    # A stalled probe does not prove that its guess is below the optimal cost, cancelling the negative cycles left in
+    # the residual graph of the flow proves that it is optimal
+    best_flow = np.asarray(best_flow).astype(np.int64)
+    cancelled_cycles = cancel_negative_cycles(I, best_flow)
+    if instrumentation.tracer is not None:
+        instrumentation.tracer.count("cancelled_cycles", cancelled_cycles)
+    best_flow = best_flow.astype(np.float64)
+    return np.dot(I.costs, best_flow), best_flow, warm_flow
+
+# Raise a ValueError for more than one probe per round with exact_rounding, where the first probe ends the search
+def check_probes_per_round(probes_per_round: int, exact_rounding: bool):
+    if probes_per_round > 1 and exact_rounding:
+        raise ValueError("probes_per_round > 1 only applies without exact_rounding, the first probe of an exact search "
+                         "already ends it")
+
+# Split the bracket [l, r) into k + 1 parts and return the k distinct guesses in between, in increasing order
+def split_bracket(l: int, r: int, k: int) -> list[int]:
+    return sorted(set(l + (r - l) * (i + 1) // (k + 1) for i in range(k)))
+
+# Process pool evaluating optimal cost guesses on a feasible instance whose arrays and circulations live in shared
+# memory, the tracing of the workers is merged into the tracer of the parent
+class ProbePool:
+    def __init__(self, I: MinCostFlow, cycle_strategy: str, workers: int, threshold: float = 1e-5, mp_context=None):
+        circulations = find_cached_circulations(I, cycle_strategy).tocsr()
+        self.memory = []
+        specs = {}
+        arrays = {"demands": I.demands, "tails": I.tails, "heads": I.heads, "costs": I.costs,
+                  "lower_capacities": I.lower_capacities, "upper_capacities": I.upper_capacities,
+                  "circulation_data": circulations.data, "circulation_indices": circulations.indices,
+                  "circulation_indptr": circulations.indptr, "warm_flow": np.zeros(I.m, dtype=np.float64)}
+        for name, array in arrays.items():
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+            self.memory.append(block)
+            specs[name] = (block.name, array.shape, array.dtype.str)
+        self.warm_flow = np.ndarray(I.m, dtype=np.float64, buffer=self.memory[-1].buf)
+        tracer = instrumentation.tracer
+        keep_events = tracer is not None and (tracer.keep_events or tracer.callback is not None
+                                              or tracer.file is not None)
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=mp_context, initializer=init_probe_worker,
+                                            initargs=(specs, I.n, I.auxiliary_edges, cycle_strategy, threshold,
+                                                      tracer is not None, keep_events))
+
+    # Evaluate all guesses from the given warm start flow, returns the final and interior flow of every guess
+    def evaluate(self, mids: list[int], warm_flow: np.ndarray, min_progress: float = None):
+        self.warm_flow[:] = warm_flow
+        tracer = instrumentation.tracer
+        offset = 0 if tracer is None else time.perf_counter() - tracer.start # Worker events count from their task
+        results = []
+        for current_flow, interior_flow, trace in self.executor.map(evaluate_probe, mids, [min_progress] * len(mids)):
+            if trace is not None and tracer is not None:
+                tracer.merge(*trace, offset)
+            results.append((current_flow, interior_flow))
+        return results
+
+    def close(self):
+        self.executor.shutdown()
+        del self.warm_flow
+        for block in self.memory:
+            block.close()
+            block.unlink()
+
+# Per process state of a probe worker
+probe_worker = {}
+
+# Attach to the shared arrays and build the feasible instance of this worker and its min ratio cycle finder on top of
+# them. The worker only traces if the parent did when the pool was created
+def init_probe_worker(specs: dict, nodes: int, auxiliary_edges: int, cycle_strategy: str, threshold: float,
+                      trace: bool, keep_events: bool):
+    arrays = {}
+    for name, (block_name, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        probe_worker.setdefault("memory", []).append(block)
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+    probe_worker["flow"] = arrays.pop("warm_flow")
+    indptr = arrays.pop("circulation_indptr")
+    circulations = sp.csr_matrix((arrays.pop("circulation_data"), arrays.pop("circulation_indices"), indptr),
+                                 shape=(len(indptr) - 1, len(probe_worker["flow"])))
+    I = MinCostFlow.from_arrays(nodes, **arrays)
+    I.auxiliary_edges = auxiliary_edges
+    I.min_ratio_cycle_finder = DynamicMinRatioCycleFinder(circulations)
+    probe_worker["instance"] = I
+    probe_worker["cycle_strategy"] = cycle_strategy
+    probe_worker["threshold"] = threshold
+    instrumentation.tracer = Tracer(keep_events=keep_events) if trace else None
+
+# Evaluate a single optimal cost guess inside a probe worker. Returns the final and interior flow, together with the
+# events and counters that the worker traced for this guess or None if it does not trace
+def evaluate_probe(mid: int, min_progress: float):
+    tracer = instrumentation.tracer
+    if tracer is not None:
+        tracer.events = []
+        tracer.counters = Counter()
+        tracer.start = time.perf_counter()
+    current_flow, interior_flow = improve_flow(probe_worker["instance"], probe_worker["flow"], mid,
+                                               probe_worker["cycle_strategy"], probe_worker["threshold"], min_progress)
+    return current_flow, interior_flow, None if tracer is None else (tracer.events, tracer.counters)
+
 # Solve the max flow problem instance using the static algorithm
-def find_max_flow(I: MaxFlow):
+def find_max_flow(I: MaxFlow, cycle_strategy: str = "all_cycles", probes_per_round: int = 1, workers: int = None,
+                  exact_rounding: bool = True):
     I = I.to_min_cost_flow()
-    min_cost, min_cost_flow = find_min_cost_flow(I)
+    min_cost, min_cost_flow = find_min_cost_flow(I, cycle_strategy, probes_per_round, workers, exact_rounding)
     max_flow_value = -min_cost
     max_flow = min_cost_flow[:-1]
     return max_flow_value, max_flow
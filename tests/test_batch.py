@@ -0,0 +1,67 @@
+import json
+import os
+import shutil
+
+import pytest
+
+from implementation import batch
+from implementation.instance_io import load_instance, write_dimacs
+
+EXAMPLES = os.path.join(os.path.dirname(__file__), os.pardir)
+MIN_COST_FLOW_EXAMPLE = os.path.join(EXAMPLES, "min_cost_flow_examples", "example1.json")
+MAX_FLOW_EXAMPLE = os.path.join(EXAMPLES, "max_flow_examples", "example1.json")
+
+
+# Directory with the min cost flow example as json, DIMACS and binary instance, the max flow example as json and a
+# file that is not an instance
+@pytest.fixture
+def instance_directory(tmp_path):
+    shutil.copy(MIN_COST_FLOW_EXAMPLE, tmp_path / "min_cost_flow.json")
+    shutil.copy(MAX_FLOW_EXAMPLE, tmp_path / "max_flow.json")
+    write_dimacs(load_instance(MIN_COST_FLOW_EXAMPLE), str(tmp_path / "min_cost_flow.min"))
+    load_instance(MIN_COST_FLOW_EXAMPLE).to_binary(str(tmp_path / "min_cost_flow_binary"))
+    (tmp_path / "notes.txt").write_text("not an instance")
+    return tmp_path
+
+
+def test_read_instances_of_a_directory(instance_directory):
+    instances = batch.read_instances(str(instance_directory), "static")
+    assert [(os.path.basename(path), backend) for path, backend in instances] == [
+        ("max_flow.json", "static"), ("min_cost_flow.json", "static"), ("min_cost_flow.min", "static"),
+        ("min_cost_flow_binary", "static")]
+
+
+def test_read_instances_of_a_manifest(instance_directory):
+    manifest = instance_directory / "manifest.json"
+    manifest.write_text(json.dumps(["min_cost_flow.json", {"path": "max_flow.json", "backend": "static"}]))
+    assert batch.read_instances(str(manifest)) == [
+        (os.path.join(str(instance_directory), "min_cost_flow.json"), "auto"),
+        (os.path.join(str(instance_directory), "max_flow.json"), "static")]
+
+
+@pytest.mark.parametrize("name", ["min_cost_flow.json", "min_cost_flow.min", "min_cost_flow_binary", "max_flow.json"])
+def test_backends_agree_on_the_value(instance_directory, name):
+    path = str(instance_directory / name)
+    results = {backend: batch.solve_instance(path, backend) for backend in ["static", "nx", "auto"]}
+    assert results["auto"]["backend"] == batch.AUTO_BACKEND
+    values = [result["value"] for result in results.values()]
+    assert all(type(value) is int for value in values)
+    assert len(set(values)) == 1
+    assert results["static"]["problem"] == ("max_flow" if name == "max_flow.json" else "min_cost_flow")
+
+
+def test_unknown_backend_raises():
+    with pytest.raises(ValueError):
+        batch.solve_instance(MIN_COST_FLOW_EXAMPLE, "simplex")
+
+
+def test_solve_batch_reports_every_entry(instance_directory):
+    manifest = instance_directory / "manifest.json"
+    manifest.write_text(json.dumps(["min_cost_flow.json", {"path": "max_flow.json", "backend": "static"},
+                                    "missing.json"]))
+    results = {os.path.basename(result["path"]): result for result in batch.solve_batch(str(manifest), workers=2)}
+    assert set(results) == {"min_cost_flow.json", "max_flow.json", "missing.json"}
+    assert results["min_cost_flow.json"]["backend"] == "nx"
+    assert results["max_flow.json"]["backend"] == "static"
+    assert results["max_flow.json"]["value"] == batch.solve_instance(MAX_FLOW_EXAMPLE, "nx")["value"]
+    assert "FileNotFoundError" in results["missing.json"]["error"]
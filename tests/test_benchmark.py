@@ -0,0 +1,23 @@
+import tracemalloc
+
+from implementation.benchmark import measure, run_benchmarks
+
+
+def test_measure_times_the_call_without_tracing_allocations():
+    calls = []
+
+    def allocate():
+        calls.append(tracemalloc.is_tracing())
+        return bytearray(1 << 20)
+
+    result, seconds, peak_bytes = measure(allocate)
+    assert len(result) == 1 << 20 and seconds > 0
+    assert calls == [False, True]
+    assert peak_bytes >= 1 << 20
+
+
+def test_static_solver_only_runs_up_to_the_edge_limit():
+    reports = list(run_benchmarks(["grid"], [2], [0], [(10, 10)], max_static_edges=4))
+    assert reports[0]["m"] == 4 and reports[0]["costs_match"]
+    reports = list(run_benchmarks(["grid"], [2], [0], [(10, 10)], max_static_edges=3))
+    assert "static_cost" not in reports[0] and "nx_cost" in reports[0]
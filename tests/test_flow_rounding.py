@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from implementation import instrumentation, nx_algorithm, static_algorithm
+from implementation.benchmark import dense_instance, grid_instance
+from implementation.flow_rounding import round_to_optimal_flow
+from implementation.intial_point import find_initial_feasible_flow
+from implementation.min_cost_flow import MinCostFlow
+from implementation.solver_session import SolverSession
+
+
+# Dense instance with parallel edges, whose edges all get a random lower capacity, the demands are those of a random
+# flow within the capacities so that the instance stays feasible
+def instance_with_lower_bounds(seed: int) -> MinCostFlow:
+    I = dense_instance(seed, 5, 25) # More edges than ordered pairs of nodes
+    rng = np.random.default_rng(seed)
+    I.lower_capacities = rng.integers(0, I.upper_capacities + 1) // 2
+    I.demands = I.find_demand_residuals(rng.integers(I.lower_capacities, I.upper_capacities + 1)).astype(int)
+    return I
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_rounding_matches_networkx(seed):
+    I = instance_with_lower_bounds(seed)
+    assert len(set(I.edges)) < I.m # The instance has parallel edges
+    flow = np.random.default_rng(seed).uniform(I.lower_capacities, I.upper_capacities)
+    optimal_flow = round_to_optimal_flow(I, flow)
+    assert I.is_feasible_flow(optimal_flow)
+    assert np.dot(I.costs, optimal_flow) == nx_algorithm.find_min_cost_flow(I.copy())[0]
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_exact_search_matches_networkx(seed):
+    I = instance_with_lower_bounds(seed)
+    cost, flow = static_algorithm.find_min_cost_flow(I.copy(), "spanning_tree")
+    assert I.is_feasible_flow(flow)
+    assert cost == np.dot(I.costs, flow) == nx_algorithm.find_min_cost_flow(I.copy())[0]
+
+
+def test_infeasible_demands_round_to_none():
+    I = MinCostFlow(nodes=4, demands=[4, 0, 0, -4], edges=[(0, 1), (1, 3), (0, 2), (2, 3), (1, 2)],
+                    costs=[1, 1, 2, 2, 1], lower_capacities=[0, 0, 0, 0, 0], upper_capacities=[2, 2, 1, 1, 3])
+    assert round_to_optimal_flow(I, (I.lower_capacities + I.upper_capacities) / 2) is None
+
+
+# Demands beyond the capacities that scipy's maximum flow accepts are repaired over several rounds
+def test_demands_beyond_int32_are_repaired():
+    def instance():
+        return MinCostFlow(nodes=3, demands=[3 * 10 ** 9, 0, -3 * 10 ** 9], edges=[(0, 1), (1, 2), (0, 2)],
+                           costs=[1, 1, 5], lower_capacities=[0, 0, 0], upper_capacities=[4 * 10 ** 9] * 3)
+    I = instance()
+    optimal_cost = nx_algorithm.find_min_cost_flow(I.copy())[0]
+    optimal_flow = round_to_optimal_flow(I, np.zeros(I.m))
+    assert I.is_feasible_flow(optimal_flow)
+    assert np.dot(I.costs, optimal_flow) == optimal_cost == 6 * 10 ** 9
+    assert static_algorithm.find_min_cost_flow(instance(), "spanning_tree")[0] == optimal_cost
+    assert SolverSession(instance(), "spanning_tree").solve()[0] == optimal_cost
+
+
+# Rounding the flow of a probe that reached the optimal cost needs no repair and no cancellation at all,
+# while rounding the start flow needs both
+def test_interior_point_iterations_reduce_rounding_work():
+    I = grid_instance(0, 3, 3)
+    optimal_cost = nx_algorithm.find_min_cost_flow(I.copy())[0]
+    I_feasible, start_flow = find_initial_feasible_flow(I)
+    flow, _ = static_algorithm.improve_flow(I_feasible, start_flow, optimal_cost, "all_cycles",
+                                            static_algorithm.EXACT_ROUNDING_THRESHOLD)
+    work = {}
+    for name, rounded_flow in [("start", start_flow), ("probe", flow)]:
+        with instrumentation.tracing(instrumentation.Tracer(keep_events=False)) as tracer:
+            assert np.dot(I.costs, round_to_optimal_flow(I, rounded_flow[:I.m])) == optimal_cost
+        work[name] = tracer.counters["repaired_units"], tracer.counters["cancelled_cycles"]
+    assert work["probe"] == (0, 0)
+    assert min(work["start"]) > 0
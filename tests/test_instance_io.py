@@ -0,0 +1,128 @@
+import os
+
+import numpy as np
+import pytest
+
+from implementation import nx_algorithm, static_algorithm
+from implementation.instance_io import (convert_to_binary, load_instance, read_dimacs, write_dimacs,
+                                        write_dimacs_solution)
+from implementation.max_flow import MaxFlow
+from implementation.min_cost_flow import MinCostFlow
+from implementation.solver_session import SolverSession
+
+EXAMPLES = os.path.join(os.path.dirname(__file__), os.pardir)
+
+
+def test_min_cost_flow_round_trip(tmp_path):
+    I = MinCostFlow(nodes=4, demands=[3, 0, -1, -2], edges=[(0, 1), (1, 2), (0, 2), (2, 3), (1, 3)],
+                    costs=[1, -2, 3, 4, 5], lower_capacities=[0, 1, 0, 0, 2], upper_capacities=[3, 4, 5, 6, 7])
+    write_dimacs(I, tmp_path / "instance.min")
+    J = read_dimacs(str(tmp_path / "instance.min"))
+    assert J.n == I.n and J.m == I.m
+    for name in ["demands", "tails", "heads", "costs", "lower_capacities", "upper_capacities"]:
+        np.testing.assert_array_equal(getattr(J, name), getattr(I, name))
+
+
+def test_max_flow_round_trip(tmp_path):
+    I = MaxFlow(edges=[(0, 1), (1, 3), (0, 2), (2, 3)], upper_capacities=[4, 3, 2, 5], source=0, sink=3)
+    write_dimacs(I, tmp_path / "instance.max")
+    J = read_dimacs(str(tmp_path / "instance.max"))
+    assert (J.source, J.sink) == (I.source, I.sink)
+    np.testing.assert_array_equal(J.tails, I.tails)
+    np.testing.assert_array_equal(J.heads, I.heads)
+    np.testing.assert_array_equal(J.upper_capacities, I.upper_capacities)
+
+
+def test_max_flow_with_lower_capacities_is_not_written(tmp_path):
+    I = MaxFlow(edges=[(0, 1), (1, 2)], upper_capacities=[4, 3], source=0, sink=2, lower_capacities=[2, 2])
+    with pytest.raises(ValueError):
+        write_dimacs(I, tmp_path / "instance.max")
+    I.lower_capacities[:] = 0 # Zero lower capacities are what the format assumes anyway
+    write_dimacs(I, tmp_path / "instance.max")
+    np.testing.assert_array_equal(read_dimacs(str(tmp_path / "instance.max")).upper_capacities, [4, 3])
+
+
+def test_write_dimacs_solution(tmp_path):
+    I = MaxFlow(edges=[(0, 1), (1, 2)], upper_capacities=[4, 3], source=0, sink=2)
+    write_dimacs_solution(I, tmp_path / "solution.txt", 3.0, np.array([2.9999, 3.0001]))
+    assert (tmp_path / "solution.txt").read_text() == "s 3\nf 1 2 3\nf 2 3 3\n"
+
+
+def test_read_dimacs_ignores_leading_whitespace(tmp_path):
+    path = tmp_path / "instance.min"
+    path.write_text("c comment\n  p min 2 1\n\tn 1 2\n n 2 -2\n   a 1 2 0 5 3\n")
+    I = read_dimacs(str(path))
+    np.testing.assert_array_equal(I.demands, [2, -2])
+    np.testing.assert_array_equal(I.upper_capacities, [5])
+
+
+@pytest.mark.parametrize("arcs, message", [("a 1 2 0 5 3\na 2 1 0 5 3\n", "found more"),
+                                           ("a 1 2 0 5\n", "fields"),
+                                           ("", "found 0")])
+def test_read_dimacs_rejects_arc_count_mismatches(tmp_path, arcs, message):
+    path = tmp_path / "instance.min"
+    path.write_text("p min 2 1\nn 1 2\nn 2 -2\n" + arcs)
+    with pytest.raises(ValueError, match=message):
+        read_dimacs(str(path))
+
+
+def min_cost_flow_with_lower_capacities() -> MinCostFlow:
+    return MinCostFlow(nodes=4, demands=[3, 0, -1, -2], edges=[(0, 1), (1, 2), (0, 2), (2, 3), (1, 3)],
+                       costs=[1, -2, 3, 4, 5], lower_capacities=[0, 1, 0, 0, 2], upper_capacities=[3, 4, 5, 6, 7])
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_min_cost_flow_binary_round_trip(tmp_path, mmap):
+    I = min_cost_flow_with_lower_capacities()
+    I.to_binary(str(tmp_path / "instance"))
+    J = load_instance(str(tmp_path / "instance"), mmap)
+    assert isinstance(J, MinCostFlow) and J.n == I.n and J.m == I.m
+    for name in ["demands", "tails", "heads", "costs", "lower_capacities", "upper_capacities"]:
+        np.testing.assert_array_equal(getattr(J, name), getattr(I, name))
+        assert getattr(J, name).flags.writeable != mmap
+    assert J.edges == I.edges
+
+
+@pytest.mark.parametrize("lower_capacities", [None, [1, 0, 0, 2]])
+def test_max_flow_binary_round_trip(tmp_path, lower_capacities):
+    I = MaxFlow(edges=[(0, 1), (1, 3), (0, 2), (2, 3)], upper_capacities=[4, 3, 2, 5], source=0, sink=3,
+                lower_capacities=lower_capacities)
+    I.to_binary(str(tmp_path / "instance"))
+    J = load_instance(str(tmp_path / "instance"))
+    assert isinstance(J, MaxFlow) and (J.source, J.sink) == (I.source, I.sink)
+    for name in ["tails", "heads", "upper_capacities"]:
+        np.testing.assert_array_equal(getattr(J, name), getattr(I, name))
+    if lower_capacities is None:
+        assert J.lower_capacities is None
+    else:
+        np.testing.assert_array_equal(J.lower_capacities, lower_capacities)
+    assert J.edges == I.edges
+
+
+def test_binary_instance_of_other_format_is_rejected(tmp_path):
+    min_cost_flow_with_lower_capacities().to_binary(str(tmp_path / "instance"))
+    with pytest.raises(ValueError, match="expected max_flow"):
+        MaxFlow.from_binary(str(tmp_path / "instance"))
+
+
+@pytest.mark.parametrize("example", ["min_cost_flow_examples", "max_flow_examples"])
+def test_convert_to_binary(tmp_path, example):
+    json_path = os.path.join(EXAMPLES, example, "example1.json")
+    I = load_instance(json_path)
+    convert_to_binary(json_path, str(tmp_path / "instance"))
+    J = load_instance(str(tmp_path / "instance"))
+    assert type(J) is type(I)
+    assert J.edges == I.edges
+    np.testing.assert_array_equal(J.upper_capacities, I.upper_capacities)
+
+
+# The solvers get the read-only memory-mapped arrays of a binary instance and must not write into them
+def test_memory_mapped_instance_is_solved(tmp_path):
+    I = min_cost_flow_with_lower_capacities()
+    I.to_binary(str(tmp_path / "instance"))
+    optimal_cost = nx_algorithm.find_min_cost_flow(I.copy())[0]
+    assert nx_algorithm.find_min_cost_flow(load_instance(str(tmp_path / "instance")))[0] == optimal_cost
+    assert static_algorithm.find_min_cost_flow(load_instance(str(tmp_path / "instance")), "spanning_tree")[0] \
+        == optimal_cost
+    assert SolverSession(load_instance(str(tmp_path / "instance")), "spanning_tree").solve()[0] == optimal_cost
+    np.testing.assert_array_equal(load_instance(str(tmp_path / "instance")).demands, I.demands)
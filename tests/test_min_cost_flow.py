@@ -0,0 +1,56 @@
+import numpy as np
+
+from implementation.min_cost_flow import MinCostFlow
+
+
+def small_instance():
+    return MinCostFlow(nodes=3, demands=[2, 0, -2], edges=[(0, 1), (1, 2), (0, 2)], costs=[1, 1, 3],
+                       lower_capacities=[0, 0, 0], upper_capacities=[2, 2, 2])
+
+
+def test_add_edges_extends_existing_edge_lists():
+    I = small_instance()
+    I.undirected_edge_index_map # Build the map before adding edges
+    I.add_edges([2, 1], [0, 0], [4, 5], [0, 0], [1, 3])
+    assert I.m == 5
+    assert I.edges[3:] == [(2, 0), (1, 0)]
+    assert I.undirected_edge_index_map[(0, 2)] == [2, 3]
+    assert I.undirected_edge_index_map[(0, 1)] == [0, 4]
+    assert I.U == 3
+
+
+def test_add_edges_keeps_edge_lists_lazy():
+    I = small_instance()
+    I = MinCostFlow.from_arrays(I.n, I.demands, I.tails, I.heads, I.costs, I.lower_capacities, I.upper_capacities)
+    I.add_edges(np.array([2]), np.array([0]), np.array([4]), np.array([0]), np.array([1]))
+    assert I._edges is None and I._undirected_edge_index_map is None
+    assert I.edges == [(0, 1), (1, 2), (0, 2), (2, 0)]
+    assert I.undirected_edge_index_map[(2, 0)] == [2, 3]
+    np.testing.assert_array_equal(I.find_demand_residuals(np.array([1, 1, 1, 0])), [2, 0, -2])
+
+
+def test_fused_potential_matches_the_separate_evaluations():
+    I = small_instance()
+    flow = np.array([0.5, 1.5, 1.0])
+    phi, gradients, lengths = I.find_potential(flow, 3)
+    assert np.isclose(phi, I.find_phi(flow, 3))
+    np.testing.assert_allclose(gradients, I.find_gradients(flow, 3))
+    np.testing.assert_allclose(lengths, I.find_lengths(flow))
+    phi, gradients, lengths = I.find_potential(flow, 3, np.float32)
+    assert gradients.dtype == lengths.dtype == np.float32
+    assert np.isclose(phi, I.find_phi(flow, 3), rtol=1e-5)
+    np.testing.assert_allclose(gradients, I.find_gradients(flow, 3), rtol=1e-5)
+    np.testing.assert_allclose(lengths, I.find_lengths(flow), rtol=1e-5)
+
+
+def test_slack_powers_are_cached_per_flow():
+    I = small_instance()
+    flow = np.array([0.5, 1.5, 1.0])
+    buffers = I.find_slack_powers(flow)
+    powers = buffers.upper_powers.copy()
+    buffers.upper_powers[:] = 0 # A second evaluation of the same flow reuses the buffers
+    assert not np.any(I.find_slack_powers(flow).upper_powers)
+    buffers.upper_powers[:] = powers
+    I.upper_capacities[0] = 3
+    I.reset_potential_cache()
+    np.testing.assert_allclose(I.find_barrier_terms(flow)[1], I.find_lengths(flow))
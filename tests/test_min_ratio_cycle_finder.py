@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from implementation.benchmark import grid_instance
+from implementation.intial_point import find_initial_feasible_flow
+from implementation.min_ratio_cycle_finder import DynamicMinRatioCycleFinder
+from implementation.min_ratio_cycles import find_fundamental_circulations
+
+
+def test_add_new_circulations_skips_stored_cycles_in_either_direction():
+    I, flow = find_initial_feasible_flow(grid_instance(0, 3, 3))
+    circulations = find_fundamental_circulations(I)
+    finder = DynamicMinRatioCycleFinder(circulations)
+    assert finder.add_new_circulations(circulations) == 0
+    assert finder.add_new_circulations(-circulations) == 0
+    weights = np.random.default_rng(0).random(I.m)
+    added = finder.add_new_circulations(find_fundamental_circulations(I, weights))
+    assert 0 < added == len(finder) - circulations.shape[0]
+    assert finder.add_new_circulations(find_fundamental_circulations(I, weights)) == 0
+
+
+def test_added_circulations_are_scored_like_a_full_update():
+    I, flow = find_initial_feasible_flow(grid_instance(1, 3, 3))
+    optimal_cost = int(np.dot(I.costs, flow)) - 10
+    finder = DynamicMinRatioCycleFinder(find_fundamental_circulations(I))
+    finder.update(I, flow, optimal_cost)
+    finder.add_new_circulations(find_fundamental_circulations(I, np.random.default_rng(0).random(I.m)))
+    fresh = DynamicMinRatioCycleFinder(finder.circulations)
+    fresh.update(I, flow, optimal_cost)
+    np.testing.assert_allclose(finder.cost_products, fresh.cost_products)
+    np.testing.assert_allclose(finder.barrier_products, fresh.barrier_products)
+    np.testing.assert_allclose(finder.norms, fresh.norms)
+    assert finder.find_tracked_min_ratio_cycle()[0] == fresh.find_tracked_min_ratio_cycle()[0]
+
+
+# The tracked scores of a flow reached by partial updates select the same cycle as scoring the gradients and lengths
+# of that flow from scratch
+@pytest.mark.parametrize("seed", range(5))
+def test_tracked_and_untracked_scoring_select_the_same_cycle(seed):
+    I, flow = find_initial_feasible_flow(grid_instance(seed, 4, 4))
+    optimal_cost = int(np.dot(I.costs, flow)) - 10
+    finder = DynamicMinRatioCycleFinder(find_fundamental_circulations(I))
+    rng = np.random.default_rng(seed)
+    for _ in range(5):
+        finder.update(I, flow, optimal_cost)
+        ratio, circulation, _ = finder.find_tracked_min_ratio_cycle()
+        untracked_ratio, untracked_circulation = finder.find_min_ratio_cycle(I.find_gradients(flow, optimal_cost),
+                                                                             I.find_lengths(flow))
+        assert ratio == pytest.approx(untracked_ratio)
+        np.testing.assert_array_equal(circulation, untracked_circulation)
+        flow = flow.copy()
+        changed = rng.choice(I.m, 2, replace=False)
+        flow[changed] = rng.uniform(I.lower_capacities[changed], I.upper_capacities[changed])
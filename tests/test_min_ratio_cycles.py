@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from implementation import static_algorithm
+from implementation.benchmark import grid_instance
+from implementation.circulation_cache import CirculationCache
+from implementation.intial_point import find_initial_feasible_flow
+from implementation.min_cost_flow import MinCostFlow
+from implementation.min_ratio_cycles import find_cached_circulations, find_circulations
+
+
+@pytest.mark.parametrize("strategy", ["all_cycles", "spanning_tree"])
+def test_flipping_the_excess_signs_hits_the_cache(strategy):
+    I = grid_instance(0, 3, 3)
+    I_feasible, flow = find_initial_feasible_flow(I)
+    cache = CirculationCache()
+    find_cached_circulations(I_feasible, strategy, cache)
+    assert (cache.hits, cache.misses) == (0, 2)
+    # Demands mirrored around those of the midpoint flow turn every auxiliary edge around
+    midpoint_demands = I.find_demand_residuals(flow[:I.m])
+    I_flipped = I.copy()
+    I_flipped.demands = np.rint(2 * midpoint_demands - I.demands).astype(I.demands.dtype)
+    I_flipped_feasible, _ = find_initial_feasible_flow(I_flipped)
+    assert np.all(I_flipped_feasible.tails[I.m:] == I_feasible.heads[I.m:])
+    circulations = find_cached_circulations(I_flipped_feasible, strategy, cache)
+    assert (cache.hits, cache.misses) == (2, 2)
+    np.testing.assert_array_equal(circulations @ incidence_matrix(I_flipped_feasible), 0)
+    assert np.linalg.matrix_rank(circulations.toarray()) == I_flipped_feasible.m - I_flipped_feasible.n + 1
+
+
+def test_all_cycles_with_parallel_edges_are_circulations():
+    I = MinCostFlow(nodes=3, demands=[0, 0, 0], edges=[(0, 1), (0, 1), (1, 0), (1, 2), (2, 0)], costs=[1] * 5,
+                    lower_capacities=[0] * 5, upper_capacities=[1] * 5)
+    circulations = find_circulations(I, "all_cycles").toarray()
+    np.testing.assert_array_equal(circulations @ incidence_matrix(I), 0)
+    assert np.linalg.matrix_rank(circulations) == I.m - I.n + 1
+
+
+@pytest.mark.parametrize("strategy", ["all_cycles", "spanning_tree"])
+def test_graph_without_cycles_takes_no_step(strategy):
+    I = MinCostFlow(nodes=2, demands=[1, -1], edges=[(0, 1)], costs=[3], lower_capacities=[0], upper_capacities=[2])
+    cost, flow = static_algorithm.find_min_cost_flow(I, strategy, exact_rounding=False)
+    assert cost == 3
+    np.testing.assert_array_equal(flow, [1])
+
+
+def incidence_matrix(I):
+    B = np.zeros((I.m, I.n))
+    B[np.arange(I.m), I.tails] = 1
+    B[np.arange(I.m), I.heads] = -1
+    return B
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+from implementation import nx_algorithm
+from implementation.benchmark import grid_instance
+from implementation.solver_session import SolverSession
+
+
+@pytest.mark.parametrize("exact_rounding", [False, True])
+def test_re_solves_match_networkx_after_updates(exact_rounding):
+    rng = np.random.default_rng(0)
+    session = SolverSession(grid_instance(0, 3, 3), "all_cycles", exact_rounding=exact_rounding)
+    session.solve()
+    for update in ["costs", "increase", "decrease", "demands", "costs"]:
+        I = session.I
+        edges = rng.choice(I.m, 2, replace=False)
+        if update == "costs":
+            session.update_costs(edges, rng.integers(1, 11, 2))
+        elif update == "increase":
+            session.update_upper_capacities(edges, I.upper_capacities[edges] + 2)
+        elif update == "decrease": # Cut the capacity of the edges carrying the most flow
+            edges = np.argsort(session.flow)[-2:]
+            session.update_upper_capacities(edges, I.upper_capacities[edges] - 1)
+        else: # Move one unit of supply along the edge with the most spare capacity
+            edge = np.argmax(I.upper_capacities - session.flow)
+            demands = I.demands.copy()
+            demands[I.tails[edge]] += 1
+            demands[I.heads[edge]] -= 1
+            session.update_demands(np.arange(I.n), demands)
+        cost, flow = session.solve()
+        assert I.is_feasible_flow(flow)
+        assert cost == np.dot(I.costs, flow) == nx_algorithm.find_min_cost_flow(I.copy())[0]
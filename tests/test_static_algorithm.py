@@ -0,0 +1,118 @@
+import multiprocessing
+
+import numpy as np
+import pytest
+
+from implementation import instrumentation, nx_algorithm, static_algorithm
+from implementation.benchmark import dense_instance, grid_instance
+from implementation.flow_rounding import round_to_optimal_flow
+from implementation.intial_point import find_initial_feasible_flow
+from implementation.max_flow import MaxFlow
+from implementation.min_cost_flow import MinCostFlow
+from implementation.solver_session import SolverSession
+
+
+def test_warm_started_search_finds_the_optimum():
+    I = grid_instance(0, 3, 3)
+    cost, flow = static_algorithm.find_min_cost_flow(I.copy(), "all_cycles", exact_rounding=False)
+    assert I.is_feasible_flow(flow)
+    assert cost == nx_algorithm.find_min_cost_flow(I.copy())[0] == np.dot(I.costs, flow)
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_search_with_parallel_edges_finds_the_optimum(seed):
+    I = dense_instance(seed, 3, 9)
+    cost, flow = static_algorithm.find_min_cost_flow(I.copy(), "all_cycles", exact_rounding=False)
+    assert I.is_feasible_flow(flow)
+    assert cost == nx_algorithm.find_min_cost_flow(I.copy())[0] == np.dot(I.costs, flow)
+
+
+# Small random instance with parallel and antiparallel edges, negative costs and lower capacities, the demands are
+# those of a random flow within the capacities so that the instance is feasible
+def random_instance_with_lower_bounds(seed: int) -> MinCostFlow:
+    rng = np.random.default_rng(seed)
+    tails = rng.integers(0, 3, 6)
+    heads = (tails + rng.integers(1, 3, 6)) % 3
+    lower_capacities = rng.integers(0, 3, 6)
+    upper_capacities = lower_capacities + rng.integers(0, 5, 6)
+    flow = rng.integers(lower_capacities, upper_capacities + 1)
+    I = MinCostFlow(nodes=3, demands=[0, 0, 0], edges=list(zip(tails.tolist(), heads.tolist())),
+                    costs=rng.integers(-3, 6, 6), lower_capacities=lower_capacities, upper_capacities=upper_capacities)
+    I.demands = I.find_demand_residuals(flow).astype(int)
+    return I
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_search_with_lower_bounds_matches_networkx(seed):
+    I = random_instance_with_lower_bounds(seed)
+    cost, flow = static_algorithm.find_min_cost_flow(I.copy(), "all_cycles", exact_rounding=False)
+    assert I.is_feasible_flow(flow)
+    assert cost == np.dot(I.costs, flow) == nx_algorithm.find_min_cost_flow(I.copy())[0]
+
+
+def test_stalled_probes_do_not_end_the_search_above_the_optimum():
+    I = MinCostFlow(nodes=2, demands=[-1, 1], edges=[(0, 1), (0, 1), (1, 0), (0, 1), (1, 0)], costs=[-2, 5, 5, -2, -1],
+                    lower_capacities=[0, 1, 2, 0, 2], upper_capacities=[4, 2, 7, 1, 4])
+    cost, flow = static_algorithm.find_min_cost_flow(I.copy(), "all_cycles", exact_rounding=False)
+    assert I.is_feasible_flow(flow)
+    assert cost == nx_algorithm.find_min_cost_flow(I.copy())[0] == 3
+
+
+@pytest.mark.parametrize("exact_rounding", [False, True])
+def test_infeasible_demands_raise(exact_rounding):
+    I = MinCostFlow(nodes=3, demands=[3, 0, -3], edges=[(0, 1), (1, 2), (0, 2)], costs=[1, 1, 3],
+                    lower_capacities=[0, 0, 0], upper_capacities=[1, 1, 1])
+    with pytest.raises(ValueError):
+        static_algorithm.find_min_cost_flow(I, "spanning_tree", exact_rounding=exact_rounding)
+
+
+# The probe keeps going while the cost still drops, which leaves less flow to reroute than rounding the start flow
+def test_exact_probe_runs_until_the_cost_stops_decreasing():
+    I = grid_instance(0, 6, 6)
+    with instrumentation.tracing(instrumentation.Tracer(keep_events=False)) as tracer:
+        static_algorithm.find_min_cost_flow(I.copy(), "spanning_tree")
+    with instrumentation.tracing(instrumentation.Tracer(keep_events=False)) as start_tracer:
+        round_to_optimal_flow(I, (I.lower_capacities + I.upper_capacities) / 2)
+    assert tracer.counters["iterations"] > static_algorithm.EXACT_ROUNDING_WINDOW
+    assert tracer.counters["repaired_units"] < start_tracer.counters["repaired_units"]
+
+
+def test_probe_pool_workers_do_not_rely_on_fork():
+    I_feasible, flow = find_initial_feasible_flow(grid_instance(0, 3, 3))
+    mids = [150, 250]
+    with instrumentation.tracing(instrumentation.Tracer()) as tracer:
+        pool = static_algorithm.ProbePool(I_feasible, "spanning_tree", 2,
+                                          mp_context=multiprocessing.get_context("spawn"))
+        try:
+            results = pool.evaluate(mids, flow)
+        finally:
+            pool.close()
+    assert tracer.counters["probes"] == len(mids)
+    assert [event["optimal_cost"] for event in tracer.events if event["event"] == "probe"] == mids
+    for mid, (current_flow, interior_flow) in zip(mids, results):
+        expected_flow, _ = static_algorithm.improve_flow(I_feasible.copy(), flow, mid, "spanning_tree")
+        np.testing.assert_allclose(current_flow, expected_flow)
+
+
+def test_search_with_several_probes_per_round_matches_networkx():
+    I = grid_instance(1, 3, 3)
+    with instrumentation.tracing(instrumentation.Tracer(keep_events=False)) as tracer:
+        cost, flow = static_algorithm.find_min_cost_flow(I.copy(), "all_cycles", probes_per_round=3, workers=3,
+                                                         exact_rounding=False)
+    assert tracer.counters["probes"] > 3
+    assert I.is_feasible_flow(flow)
+    assert cost == np.dot(I.costs, flow) == nx_algorithm.find_min_cost_flow(I.copy())[0]
+
+
+def test_max_flow_with_several_probes_per_round_matches_networkx():
+    I = MaxFlow(edges=[(0, 1), (0, 2), (1, 2), (1, 3), (2, 3)], upper_capacities=[3, 2, 1, 2, 3], source=0, sink=3)
+    value, _ = static_algorithm.find_max_flow(I, "all_cycles", probes_per_round=2, exact_rounding=False)
+    assert value == nx_algorithm.find_max_flow(I)[0]
+
+
+def test_several_probes_per_round_with_exact_rounding_raise():
+    I = grid_instance(0, 3, 3)
+    with pytest.raises(ValueError):
+        static_algorithm.find_min_cost_flow(I, "all_cycles", probes_per_round=2)
+    with pytest.raises(ValueError):
+        SolverSession(I, "all_cycles", probes_per_round=2)